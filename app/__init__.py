@@ -1,6 +1,11 @@
 from flask import Flask
 from .models.models import db, migrate
+from .models.engine import apply_sqlite_pragmas
+from .models.sharding import shard_count, shard_key
+from .models import search
 from .routes.routes import api_blueprint
+from .routes import fragments, changes
+from . import metrics, batching, admission, cache, profiling
 from config import config_map
 
 def create_app(app_env):
@@ -11,7 +16,29 @@ def create_app(app_env):
     app.register_blueprint(api_blueprint)
     db.init_app(app)
     with app.app_context():
+        for engine in db.engines.values():
+            apply_sqlite_pragmas(engine, app.config.get("SQLITE_PRAGMAS"))
         db.create_all()
+        # Migrations only manage shard 0, the other shards are created here
+        for shard in range(1, shard_count(app)):
+            db.metadata.create_all(db.engines[shard_key(shard)])
+        # Preloaded gunicorn workers must not inherit the master's connections
+        for engine in db.engines.values():
+            engine.dispose()
     migrate.init_app(app, db)
+    metrics.init_app(app)
+    batching.init_app(app)
+    admission.init_app(app)
+    fragments.init_app(app)
+    changes.init_app(app)
+    search.init_app(app)
+    cache.init_app(app)
+    profiling.init_app(app)
 
     return app
+
+def create_asgi_app(app_env):
+    """Serve the app from an ASGI server, on the async database engine"""
+    from .asgi import AsyncApp
+
+    return AsyncApp(create_app(app_env))
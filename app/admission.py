@@ -0,0 +1,162 @@
+import math
+import threading
+import time
+from collections import OrderedDict
+from flask import g, jsonify, request
+from .cooperative import sleep
+
+SAFE_METHODS = {"GET", "HEAD", "OPTIONS"}
+# Reads sent as POST because their input does not fit in a query string
+READ_ENDPOINTS = {"api.lookup_students"}
+# Streams mostly sleep between polls and would hold a slot for minutes
+EXEMPT_ENDPOINTS = {"api.stream_changes"}
+# How often a request queued for a slot checks whether one is free
+POLL_INTERVAL = 0.002
+
+
+def endpoint_class(request):
+    """write for changes, read for single records, listing for the rest"""
+    if (request.method not in SAFE_METHODS
+            and request.endpoint not in READ_ENDPOINTS):
+        return "write"
+    if request.view_args:
+        return "read"
+    return "listing"
+
+
+class TokenBuckets:
+    """
+    One token bucket per client, refilled at rate tokens a second up to
+    burst. Only the max_clients most recently seen clients are remembered
+    """
+
+    def __init__(self, rate, burst, max_clients=10000):
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self.lock = threading.Lock()
+        self.buckets = OrderedDict()
+
+    def take(self, client):
+        """Spend a token, returning 0 or the seconds until one is refilled"""
+        now = time.monotonic()
+        with self.lock:
+            tokens, stamp = self.buckets.pop(client, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - stamp) * self.rate)
+            if tokens >= 1:
+                tokens -= 1
+                wait = 0
+            else:
+                wait = (1 - tokens) / self.rate
+            self.buckets[client] = (tokens, now)
+            if len(self.buckets) > self.max_clients:
+                self.buckets.popitem(last=False)
+        return wait
+
+
+class Gate:
+    """
+    Concurrency cap for one endpoint class. Up to limit requests run at
+    once and up to limit more may queue for a slot. Queued requests poll
+    rather than block on a lock, so they also yield in the async mode
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.active = 0
+        self.waiting = 0
+        self.lock = threading.Lock()
+
+    def _try_enter(self):
+        with self.lock:
+            if self.active < self.limit:
+                self.active += 1
+                return True
+            return False
+
+    def enter(self, timeout):
+        """Take a slot within timeout seconds, returning whether it did"""
+        if self._try_enter():
+            return True
+        with self.lock:
+            if self.waiting >= self.limit:
+                return False
+            self.waiting += 1
+        deadline = time.monotonic() + timeout
+        try:
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                sleep(min(POLL_INTERVAL, remaining))
+                if self._try_enter():
+                    return True
+        finally:
+            with self.lock:
+                self.waiting -= 1
+
+    def leave(self):
+        with self.lock:
+            self.active -= 1
+
+
+def _refuse(status, message, retry_after):
+    response = jsonify({"error": message})
+    response.status_code = status
+    response.headers["Retry-After"] = str(max(1, math.ceil(retry_after)))
+    return response
+
+
+class AdmissionControl:
+    """
+    Turns requests away before they queue up behind an overloaded worker:
+    429 once a client runs out of tokens, 503 when its endpoint class has
+    no free slot within the latency budget
+    """
+
+    def __init__(self, config):
+        self.buckets = TokenBuckets(config["RATE_LIMIT"],
+                                    config["RATE_LIMIT_BURST"])
+        self.gates = {name: Gate(limit)
+                      for name, limit in config["CONCURRENCY_LIMITS"].items()}
+        self.timeout = config["ADMISSION_QUEUE_TIMEOUT"]
+        self.client_header = config.get("RATE_LIMIT_CLIENT_HEADER")
+
+    def client(self):
+        """Key of the rate limit bucket, the client address by default"""
+        if self.client_header and self.client_header in request.headers:
+            return request.headers[self.client_header].split(",")[0].strip()
+        return request.remote_addr
+
+    def admit(self):
+        endpoint = request.endpoint or ""
+        if not endpoint.startswith("api.") or endpoint in EXEMPT_ENDPOINTS:
+            return None
+        wait = self.buckets.take(self.client())
+        if wait:
+            return _refuse(429, "Too many requests", wait)
+        gate = self.gates[endpoint_class(request)]
+        if not gate.enter(self.timeout):
+            return _refuse(503, "Server is busy", self.timeout)
+        g.admission_gate = gate
+        return None
+
+    def release(self, error=None):
+        # Runs once a streamed response is fully sent, not when it starts
+        gate = g.pop("admission_gate", None)
+        if gate is not None:
+            gate.leave()
+
+
+def init_app(app):
+    """
+    Register per client rate limits and per endpoint class concurrency
+    caps. Nothing is registered when ADMISSION_CONTROL is off
+    """
+    if not app.config.get("ADMISSION_CONTROL"):
+        return
+
+    admission = AdmissionControl(app.config)
+    app.extensions["admission"] = admission
+    app.before_request(admission.admit)
+    app.teardown_request(admission.release)
@@ -0,0 +1,179 @@
+import io
+from contextvars import ContextVar
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.util import await_only
+from .models.models import db
+from .models.engine import apply_sqlite_pragmas
+from .models.sharding import shard_count
+from . import metrics
+
+# Async driver used for each sync backend when no async URL is configured
+ASYNC_DRIVERS = {
+    "sqlite": "aiosqlite",
+    "postgresql": "asyncpg",
+    "mysql": "aiomysql",
+}
+
+# Session of the request being served, handed out by db.session
+_request_session = ContextVar("request_session", default=None)
+
+
+def async_database_uri(app):
+    """The configured async URL, or the sync one with its async driver"""
+    uri = app.config.get("SQLALCHEMY_ASYNC_DATABASE_URI")
+    if uri:
+        return uri
+    url = make_url(app.config["SQLALCHEMY_DATABASE_URI"])
+    backend = url.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise RuntimeError(f"No async driver known for {backend}, "
+                           "set SQLALCHEMY_ASYNC_DATABASE_URI")
+    return url.set(drivername=f"{backend}+{ASYNC_DRIVERS[backend]}")
+
+
+def _use_request_sessions():
+    """Make db.session return the session of the running ASGI request"""
+    registry = db.session.registry
+    create = registry.createfunc
+    if getattr(create, "request_aware", False):
+        return
+
+    def createfunc():
+        session = _request_session.get()
+        return session if session is not None else create()
+
+    createfunc.request_aware = True
+    registry.createfunc = createfunc
+
+
+def _environ(scope, body):
+    """WSGI environ equivalent to an ASGI http scope"""
+    server = scope.get("server") or ("localhost", 80)
+    client = scope.get("client") or ("", 0)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode().decode("latin1"),
+        "PATH_INFO": scope["path"].encode().decode("latin1"),
+        "QUERY_STRING": scope["query_string"].decode("latin1"),
+        "SERVER_NAME": server[0],
+        "SERVER_PORT": str(server[1]),
+        "SERVER_PROTOCOL": f"HTTP/{scope['http_version']}",
+        "REMOTE_ADDR": client[0],
+        "REMOTE_PORT": str(client[1]),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.input_terminated": True,
+        "wsgi.errors": io.StringIO(),
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+        "CONTENT_LENGTH": str(len(body)),
+    }
+    for name, value in scope["headers"]:
+        name = name.decode("latin1").upper().replace("-", "_")
+        value = value.decode("latin1")
+        if name == "CONTENT_TYPE":
+            environ["CONTENT_TYPE"] = value
+            continue
+        if name == "CONTENT_LENGTH":
+            continue
+        key = f"HTTP_{name}"
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+class AsyncApp:
+    """
+    ASGI entry point running the Flask app on an async engine. Each request
+    is handled by the same blueprint views inside AsyncSession.run_sync, so
+    their database IO awaits on the event loop instead of holding a thread
+    """
+
+    def __init__(self, app):
+        if shard_count(app) > 1:
+            raise RuntimeError("The async mode does not support sharding")
+        self.app = app
+        with app.app_context():
+            self.engine = create_async_engine(
+                    async_database_uri(app),
+                    **app.config.get("SQLALCHEMY_ENGINE_OPTIONS", {}),
+                    )
+        apply_sqlite_pragmas(self.engine.sync_engine,
+                             app.config.get("SQLITE_PRAGMAS"))
+        if "metrics" in app.extensions:
+            metrics.instrument_engine(self.engine.sync_engine)
+        app.extensions["async_engine"] = self.engine
+        _use_request_sessions()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self.lifespan(receive, send)
+        elif scope["type"] == "http":
+            await self.handle(scope, receive, send)
+        else:
+            raise RuntimeError(f"Unsupported ASGI scope {scope['type']}")
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await self.aclose()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def aclose(self):
+        """Close every pooled connection of the async engine"""
+        await self.engine.dispose()
+
+    async def handle(self, scope, receive, send):
+        body = bytearray()
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return
+            body += message.get("body", b"")
+            if not message.get("more_body"):
+                break
+        environ = _environ(scope, bytes(body))
+
+        async with AsyncSession(self.engine) as session:
+            token = _request_session.set(session.sync_session)
+            try:
+                await session.run_sync(self._respond, environ, send)
+            finally:
+                _request_session.reset(token)
+
+    def _respond(self, sync_session, environ, send):
+        """Run the WSGI app, awaiting each send from inside the greenlet"""
+        response = {"sent": False}
+
+        def start_response(status, headers, exc_info=None):
+            response["status"] = int(status.split(" ", 1)[0])
+            response["headers"] = [(name.lower().encode("latin1"),
+                                    value.encode("latin1"))
+                                   for name, value in headers]
+
+        def send_start():
+            if not response["sent"]:
+                await_only(send({"type": "http.response.start",
+                                 "status": response["status"],
+                                 "headers": response["headers"]}))
+                response["sent"] = True
+
+        chunks = self.app(environ, start_response)
+        try:
+            for chunk in chunks:
+                send_start()
+                if chunk:
+                    await_only(send({"type": "http.response.body",
+                                     "body": chunk, "more_body": True}))
+            send_start()
+            await_only(send({"type": "http.response.body", "body": b""}))
+        finally:
+            close = getattr(chunks, "close", None)
+            if close is not None:
+                close()
@@ -0,0 +1,150 @@
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from flask import current_app
+from .cooperative import wait
+from .models.models import db, bump_revisions
+from .models.sharding import on_shard, shard_count
+from .routes.writes import Rejected
+
+
+class Job:
+    """One queued write and the future its request waits on"""
+
+    def __init__(self, write, data, revisions):
+        self.write = write
+        self.data = data
+        self.revisions = revisions
+        self.future = Future()
+
+
+class WriteBatcher:
+    """
+    Group commit for single-row writes. Writes arriving within window
+    seconds of the first one, up to batch_size of them, share one
+    transaction and so one fsync. Each runs in its own SAVEPOINT, so a
+    rejected or failing write is undone without affecting the rest of its
+    batch. There is one batcher per shard, committing to that shard only
+    """
+
+    def __init__(self, app, batch_size, window, shard=0):
+        self.app = app
+        self.shard = shard
+        self.batch_size = batch_size
+        self.window = window
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.thread = None
+        self.pid = None
+
+    def submit(self, write, data, revisions):
+        """Queue a write, returning its (body, status) once committed"""
+        self._ensure_thread()
+        job = Job(write, data, revisions)
+        self.queue.put(job)
+        return wait(job.future)
+
+    def _ensure_thread(self):
+        # Started lazily so preloaded gunicorn workers each get their own
+        with self.lock:
+            if self.thread is None or self.pid != os.getpid():
+                self.pid = os.getpid()
+                self.queue = queue.Queue()
+                self.thread = threading.Thread(
+                        target=self._run, daemon=True,
+                        name=f"write-batcher-{self.shard}")
+                self.thread.start()
+
+    def _collect(self):
+        """Block for a first job, then gather more until full or timed out"""
+        jobs = [self.queue.get()]
+        deadline = time.monotonic() + self.window
+        while len(jobs) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                jobs.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return jobs
+
+    def _run(self):
+        while True:
+            jobs = self._collect()
+            with self.app.app_context(), on_shard(self.shard):
+                try:
+                    results = self._commit(jobs)
+                except Exception as error:
+                    db.session.rollback()
+                    for job in jobs:
+                        job.future.set_exception(error)
+                else:
+                    for job, result in zip(jobs, results):
+                        if isinstance(result, Exception):
+                            job.future.set_exception(result)
+                        else:
+                            job.future.set_result(result)
+                finally:
+                    db.session.remove()
+
+    def _commit(self, jobs):
+        names = sorted(set().union(*(job.revisions for job in jobs)))
+        # A write ahead of the first SAVEPOINT makes the driver BEGIN, so
+        # the savepoints nest inside the batch transaction
+        revisions = bump_revisions(*names)
+        results = []
+        for job in jobs:
+            savepoint = db.session.begin_nested()
+            try:
+                body = job.write(job.data, revisions)
+            except Rejected as error:
+                savepoint.rollback()
+                results.append(({"error": error.message}, error.status))
+            except Exception as error:
+                # A bug in one write fails only its own request
+                savepoint.rollback()
+                results.append(error)
+            else:
+                savepoint.commit()
+                results.append((body, 201))
+        db.session.commit()
+        return results
+
+
+def perform(write, data, *revisions, shard=0):
+    """
+    Run a write from app.routes.writes on a shard after bumping the given
+    revisions, returning (body, status). Goes through the group commit
+    batcher when WRITE_BATCHING is on, otherwise commits its own transaction
+    """
+    batchers = current_app.extensions.get("write_batchers")
+    if batchers is not None:
+        return batchers[shard].submit(write, data, revisions)
+
+    with on_shard(shard):
+        bumped = bump_revisions(*revisions)
+        try:
+            body = write(data, bumped)
+        except Rejected as error:
+            db.session.rollback()
+            return {"error": error.message}, error.status
+        db.session.commit()
+    return body, 201
+
+
+def init_app(app):
+    """Register a group commit batcher per shard when WRITE_BATCHING is on"""
+    if not app.config.get("WRITE_BATCHING"):
+        return
+    app.extensions["write_batchers"] = [
+        WriteBatcher(
+            app,
+            app.config["WRITE_BATCH_SIZE"],
+            app.config["WRITE_BATCH_WINDOW"],
+            shard,
+            )
+        for shard in range(shard_count(app))
+    ]
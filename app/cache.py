@@ -0,0 +1,122 @@
+import threading
+import time
+from collections import OrderedDict
+from flask import current_app, has_app_context
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from .models.models import db
+from .models.sharding import on_shard, shard_count
+
+
+class RecordCache:
+    """
+    Read-through LRU cache of single records for one worker, each entry
+    living at most ttl seconds. Entries are tagged with the epoch of their
+    shard taken before the database read that produced them, and are only
+    served while that epoch holds. Every commit made in this process bumps
+    all epochs. A shard's epoch is also bumped when its PRAGMA data_version
+    changes, which is how SQLite reports commits from other processes
+    """
+
+    def __init__(self, max_entries, ttl, shards=1):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.epochs = [0] * shards
+        self.hits = 0
+        self.misses = 0
+
+    def invalidate(self):
+        """Make every entry stale"""
+        with self.lock:
+            self.epochs = [epoch + 1 for epoch in self.epochs]
+
+    def _sync(self, shard):
+        """Bump the epoch of a shard another process has written to"""
+        with on_shard(shard):
+            connection = db.session.connection()
+        version = connection.exec_driver_sql("PRAGMA data_version").scalar()
+        # Only commits from other connections change it, so it is tracked
+        # per connection and a connection seen for the first time counts
+        # as a change
+        if connection.info.get("data_version") != version:
+            connection.info["data_version"] = version
+            with self.lock:
+                self.epochs[shard] += 1
+
+    def stamp(self, shard):
+        """Epoch to pass to put, taken before reading what will be cached"""
+        self._sync(shard)
+        with self.lock:
+            return self.epochs[shard]
+
+    def get(self, key):
+        """The cached value of key, or None when absent, stale or expired"""
+        with self.lock:
+            entry = self.entries.get(key)
+        if entry is not None:
+            shard, epoch, expires, value = entry
+            self._sync(shard)
+            with self.lock:
+                if epoch == self.epochs[shard] and time.monotonic() < expires:
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                self.entries.pop(key, None)
+        with self.lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, shard, stamp, value):
+        with self.lock:
+            if stamp != self.epochs[shard]:
+                return
+            self.entries[key] = (shard, stamp, time.monotonic() + self.ttl,
+                                 value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def render(self):
+        """Hit and miss counters in Prometheus text format"""
+        return (
+            "# HELP record_cache_requests_total Single record cache lookups.\n"
+            "# TYPE record_cache_requests_total counter\n"
+            f'record_cache_requests_total{{result="hit"}} {self.hits}\n'
+            f'record_cache_requests_total{{result="miss"}} {self.misses}\n'
+        )
+
+
+def record_cache():
+    """The app's record cache, None when it is disabled"""
+    return current_app.extensions.get("record_cache")
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_on_commit(session):
+    # The routes write with set-based statements that mapper events do not
+    # see, so any commit in this process makes every cached record stale
+    if has_app_context():
+        cache = record_cache()
+        if cache is not None:
+            cache.invalidate()
+
+
+def init_app(app):
+    """
+    Register the record cache unless RECORD_CACHE_SIZE is 0. It relies on
+    SQLite's data_version to notice other processes' writes, so it is not
+    registered for other databases
+    """
+    if not app.config.get("RECORD_CACHE_SIZE"):
+        return
+    with app.app_context():
+        if any(engine.dialect.name != "sqlite"
+               for engine in db.engines.values()):
+            return
+    app.extensions["record_cache"] = RecordCache(
+            app.config["RECORD_CACHE_SIZE"],
+            app.config["RECORD_CACHE_TTL"],
+            shard_count(app),
+            )
@@ -0,0 +1,22 @@
+import asyncio
+import time
+from sqlalchemy.util import await_only
+from sqlalchemy.util.concurrency import in_greenlet
+
+# Requests served by AsyncApp run inside a SQLAlchemy greenlet, where
+# blocking would stall the whole event loop. These helpers await instead.
+
+
+def wait(future):
+    """Result of a concurrent.futures.Future"""
+    if in_greenlet():
+        return await_only(asyncio.wrap_future(future))
+    return future.result()
+
+
+def sleep(seconds):
+    """Pause the current request"""
+    if in_greenlet():
+        await_only(asyncio.sleep(seconds))
+    else:
+        time.sleep(seconds)
@@ -0,0 +1,159 @@
+import threading
+import time
+from collections import defaultdict
+from flask import Response, g, has_request_context, request
+from sqlalchemy import event
+from .models.models import db
+
+# Upper bounds, in seconds, of the request latency histogram buckets
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+class Metrics:
+    """
+    Request and SQL counters for one process. Each gunicorn worker keeps its
+    own, so a scrape reports the worker that happened to answer it
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self.lock = threading.Lock()
+        self.latency = defaultdict(lambda: [0] * (len(self.buckets) + 1))
+        self.latency_sum = defaultdict(float)
+        self.responses = defaultdict(int)
+        self.statements = defaultdict(int)
+        self.sql_seconds = defaultdict(float)
+
+    def observe(self, endpoint, method, status, seconds, statements,
+                sql_seconds):
+        key = (endpoint, method)
+        with self.lock:
+            counts = self.latency[key]
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    counts[i] += 1
+                    break
+            else:
+                counts[-1] += 1
+            self.latency_sum[key] += seconds
+            self.responses[key + (status,)] += 1
+            self.statements[key] += statements
+            self.sql_seconds[key] += sql_seconds
+
+    def render(self):
+        """Prometheus text exposition of every metric"""
+        lines = []
+        with self.lock:
+            lines += [
+                "# HELP http_request_duration_seconds Request latency.",
+                "# TYPE http_request_duration_seconds histogram",
+            ]
+            for (endpoint, method), counts in sorted(self.latency.items()):
+                labels = f'endpoint="{endpoint}",method="{method}"'
+                total = 0
+                for bound, count in zip(self.buckets + ("+Inf",), counts):
+                    total += count
+                    lines.append("http_request_duration_seconds_bucket"
+                                 f'{{{labels},le="{bound}"}} {total}')
+                lines.append(f"http_request_duration_seconds_sum{{{labels}}} "
+                             f"{self.latency_sum[(endpoint, method)]}")
+                lines.append("http_request_duration_seconds_count"
+                             f"{{{labels}}} {total}")
+
+            lines += [
+                "# HELP http_responses_total Responses by status code.",
+                "# TYPE http_responses_total counter",
+            ]
+            for (endpoint, method, status), count in sorted(
+                    self.responses.items()):
+                lines.append(f'http_responses_total{{endpoint="{endpoint}",'
+                             f'method="{method}",status="{status}"}} {count}')
+
+            lines += [
+                "# HELP db_statements_total SQL statements executed.",
+                "# TYPE db_statements_total counter",
+            ]
+            for (endpoint, method), count in sorted(self.statements.items()):
+                lines.append(f'db_statements_total{{endpoint="{endpoint}",'
+                             f'method="{method}"}} {count}')
+
+            lines += [
+                "# HELP db_duration_seconds_total Time spent running SQL.",
+                "# TYPE db_duration_seconds_total counter",
+            ]
+            for (endpoint, method), seconds in sorted(
+                    self.sql_seconds.items()):
+                lines.append(f'db_duration_seconds_total{{endpoint="{endpoint}",'
+                             f'method="{method}"}} {seconds}')
+        return "\n".join(lines) + "\n"
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context,
+                           executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    elapsed = time.perf_counter() - conn.info["query_start"].pop()
+    if has_request_context() and "metrics_start" in g:
+        g.metrics_statements += 1
+        g.metrics_sql_seconds += elapsed
+
+
+def instrument_engine(engine):
+    """Attribute the statements an engine runs to the current request"""
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+
+def init_app(app):
+    """
+    Time every request and the SQL it runs, exposing the totals at /metrics
+    and per response in a Server-Timing header. Nothing is registered when
+    METRICS_ENABLED is off
+    """
+    if not app.config.get("METRICS_ENABLED"):
+        return
+
+    metrics = Metrics(app.config.get("METRICS_BUCKETS", DEFAULT_BUCKETS))
+    app.extensions["metrics"] = metrics
+
+    with app.app_context():
+        for engine in db.engines.values():
+            instrument_engine(engine)
+
+    @app.before_request
+    def start_timer():
+        g.metrics_start = time.perf_counter()
+        g.metrics_statements = 0
+        g.metrics_sql_seconds = 0.0
+
+    @app.after_request
+    def record_request(response):
+        if "metrics_start" not in g:
+            return response
+        elapsed = time.perf_counter() - g.metrics_start
+        metrics.observe(
+            request.endpoint or "unmatched",
+            request.method,
+            response.status_code,
+            elapsed,
+            g.metrics_statements,
+            g.metrics_sql_seconds,
+        )
+        response.headers.add(
+            "Server-Timing",
+            f"app;dur={elapsed * 1000:.2f}, "
+            f"db;dur={g.metrics_sql_seconds * 1000:.2f};"
+            f'desc="{g.metrics_statements} queries"',
+        )
+        return response
+
+    @app.route("/metrics")
+    def export_metrics():
+        """Expose the collected metrics in Prometheus text format"""
+        text = metrics.render()
+        if "record_cache" in app.extensions:
+            text += app.extensions["record_cache"].render()
+        return Response(text, mimetype="text/plain; version=0.0.4")
@@ -0,0 +1,14 @@
+from sqlalchemy import event
+
+
+def apply_sqlite_pragmas(engine, pragmas):
+    """Run the configured PRAGMAs on every new connection of a SQLite engine"""
+    if engine.dialect.name != "sqlite" or not pragmas:
+        return
+
+    @event.listens_for(engine, "connect")
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name} = {value}")
+        cursor.close()
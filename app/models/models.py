@@ -1,8 +1,22 @@
-from sqlalchemy import String, Integer, ForeignKey, MetaData
+from sqlalchemy import (
+        Index,
+        String,
+        Integer,
+        ForeignKey,
+        MetaData,
+        bindparam,
+        delete,
+        event,
+        insert,
+        select,
+        update,
+        )
+from sqlalchemy.dialects import sqlite
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
 from sqlalchemy.ext.hybrid import hybrid_property
 from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
+from .sharding import ShardSession, scatter, shard_count
 
 migrate = Migrate()
 
@@ -17,7 +31,7 @@ convention = {
 class Base(DeclarativeBase):
     metadata = MetaData(naming_convention=convention)
 
-db = SQLAlchemy(model_class=Base)
+db = SQLAlchemy(model_class=Base, session_options={"class_": ShardSession})
 
 class School(db.Model):
     """Models a school"""
@@ -26,14 +40,32 @@ class School(db.Model):
     id: Mapped[int] = mapped_column(primary_key=True)
     name: Mapped[str] = mapped_column(String(100), unique=True, nullable=False)
     capacity: Mapped[int] = mapped_column(Integer, nullable=False)
+    student_count: Mapped[int] = mapped_column(
+            Integer,
+            nullable=False,
+            default=0,
+            server_default="0",
+            )
+    # The schools revision of the last write to the school or its students,
+    # so it changes with every such write and is never reused, even by a
+    # school that gets the id of a deleted one. See bump_revisions
+    version: Mapped[int] = mapped_column(
+            Integer,
+            nullable=False,
+            default=0,
+            server_default="0",
+            )
     students: Mapped[list["Student"]] = relationship(
             back_populates="school",
             cascade="all, delete-orphan",
+            order_by="Student.id",
             )
 
 class Student(db.Model):
     """Models a student"""
     __tablename__ = "student"
+    # Finds a school's students, already in the order they are listed
+    __table_args__ = (Index("ix_student_school_id", "school_id", "id"),)
     
     id: Mapped[str] = mapped_column(String(9), primary_key=True)
     first_name: Mapped[str] = mapped_column(String(50), nullable=False)
@@ -51,3 +83,147 @@ class Student(db.Model):
     def full_name(cls):
         """Translates full_name logic into SQL"""
         return cls.first_name + " " + cls.last_name
+
+class Change(db.Model):
+    """Models one entry of the change log, its id is the feed cursor"""
+    __tablename__ = "change"
+    # Never reuse the id of an entry removed by prune_changes, cursors
+    # must only grow
+    __table_args__ = {"sqlite_autoincrement": True}
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    resource: Mapped[str] = mapped_column(String(20), nullable=False)
+    action: Mapped[str] = mapped_column(String(10), nullable=False)
+    resource_id: Mapped[str] = mapped_column(String(20), nullable=False)
+    school_id: Mapped[int] = mapped_column(Integer, nullable=False)
+
+class Revision(db.Model):
+    """Models a change counter for a whole collection"""
+    __tablename__ = "revision"
+
+    name: Mapped[str] = mapped_column(String(20), primary_key=True)
+    value: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+
+class Claim(db.Model):
+    """
+    Models a unique key taken across every shard, a student ID or a school
+    name. Only the table of shard 0 is used, see claim_keys
+    """
+    __tablename__ = "claim"
+
+    resource: Mapped[str] = mapped_column(String(20), primary_key=True)
+    key: Mapped[str] = mapped_column(String(100), primary_key=True)
+
+REVISIONS = ("schools", "students")
+
+@event.listens_for(Revision.__table__, "after_create")
+def seed_revisions(target, connection, **kw):
+    """Start every collection counter at zero"""
+    connection.execute(insert(target), [{"name": n} for n in REVISIONS])
+
+def bump_revisions(*names):
+    """Advance collection counters in one statement, returning new values"""
+    stmt = (
+        update(Revision)
+        .where(Revision.name.in_(names))
+        .values(value=Revision.value + 1)
+        .returning(Revision.name, Revision.value)
+        .execution_options(synchronize_session=False)
+    )
+    return dict(db.session.execute(stmt).all())
+
+def record_changes(resource, action, rows):
+    """Append one change log entry per (resource_id, school_id) pair"""
+    rows = [
+        {
+            "resource": resource,
+            "action": action,
+            "resource_id": str(resource_id),
+            "school_id": school_id,
+        }
+        for resource_id, school_id in rows
+    ]
+    if rows:
+        db.session.execute(insert(Change), rows)
+
+def current_revision(name):
+    """Read a collection counter"""
+    stmt = select(Revision.value).where(Revision.name == name)
+    return db.session.execute(stmt).scalar_one()
+
+def revision_tag(name):
+    """A collection counter of every shard, joined with dots for ETags"""
+    return ".".join(str(value) for value in scatter(current_revision, name))
+
+def _schools_revision():
+    # Callers have already bumped it in the same transaction
+    return (select(Revision.value)
+            .where(Revision.name == "schools")
+            .scalar_subquery())
+
+def take_seats(school_id, seats=1):
+    """
+    Atomically claim seats in a school. Returns False, changing nothing,
+    when the school does not exist or would go over capacity
+    """
+    stmt = (
+        update(School)
+        .where(
+            School.id == school_id,
+            School.student_count + seats <= School.capacity,
+            )
+        .values(
+            student_count=School.student_count + seats,
+            version=_schools_revision(),
+            )
+        .execution_options(synchronize_session=False)
+    )
+    return db.session.execute(stmt).rowcount == 1
+
+def release_seats(school_id, seats=1):
+    """Give back seats freed by removed students"""
+    stmt = (
+        update(School)
+        .where(School.id == school_id)
+        .values(
+            student_count=School.student_count - seats,
+            version=_schools_revision(),
+            )
+        .execution_options(synchronize_session=False)
+    )
+    db.session.execute(stmt)
+
+# Each shard only enforces uniqueness among its own rows. With several,
+# student IDs and school names are also claimed on shard 0, whose primary
+# key settles concurrent creates from any process: a key is claimed in its
+# own transaction before its row is inserted on its shard, and released
+# when the insert fails or the row is deleted. Without sharding nothing is
+# claimed, each table's own constraints are enough.
+
+def claim_keys(resource, keys):
+    """Claim keys in one statement, returning those no one else holds"""
+    keys = list(dict.fromkeys(keys))
+    if shard_count() == 1 or not keys:
+        return set(keys)
+    stmt = (
+        sqlite.insert(Claim)
+        .on_conflict_do_nothing()
+        .returning(Claim.key)
+    )
+    # Outside of the session, so the claim commits on its own
+    with db.engine.begin() as connection:
+        return set(connection.execute(
+                stmt, [{"resource": resource, "key": key} for key in keys]
+                ).scalars())
+
+def release_keys(resource, keys):
+    """Give back claimed keys, after a failed insert or a deletion"""
+    keys = list(keys)
+    if shard_count() == 1 or not keys:
+        return
+    stmt = delete(Claim).where(
+            Claim.resource == resource,
+            Claim.key == bindparam("released"),
+            )
+    with db.engine.begin() as connection:
+        connection.execute(stmt, [{"released": key} for key in keys])
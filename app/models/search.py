@@ -0,0 +1,202 @@
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import (
+        event,
+        text,
+        select,
+        table,
+        column,
+        literal,
+        literal_column,
+        or_,
+        )
+from .models import db, School, Student
+
+# External content FTS5 tables using the trigram tokenizer, so a phrase query
+# behaves like a case-insensitive substring match but is answered from the
+# index. Triggers keep them in sync with every write, including bulk Core
+# statements that bypass ORM events. Requires SQLite 3.34+.
+SEARCH_INDEXES = {
+    "school_search": {
+        "create": [
+            """CREATE VIRTUAL TABLE school_search USING fts5(
+                name, content='school', content_rowid='id',
+                tokenize='trigram')""",
+        ],
+        "triggers": {
+            "school_search_ai": """
+                CREATE TRIGGER IF NOT EXISTS school_search_ai
+                AFTER INSERT ON school BEGIN
+                    INSERT INTO school_search(rowid, name)
+                    VALUES (new.id, new.name);
+                END""",
+            "school_search_ad": """
+                CREATE TRIGGER IF NOT EXISTS school_search_ad
+                AFTER DELETE ON school BEGIN
+                    INSERT INTO school_search(school_search, rowid, name)
+                    VALUES ('delete', old.id, old.name);
+                END""",
+            "school_search_au": """
+                CREATE TRIGGER IF NOT EXISTS school_search_au
+                AFTER UPDATE OF name ON school BEGIN
+                    INSERT INTO school_search(school_search, rowid, name)
+                    VALUES ('delete', old.id, old.name);
+                    INSERT INTO school_search(rowid, name)
+                    VALUES (new.id, new.name);
+                END""",
+        },
+    },
+    # student has a string primary key, so the index follows its implicit
+    # rowid. VACUUM may renumber those, run `flask rebuild-search` after it.
+    "student_search": {
+        "create": [
+            """CREATE VIRTUAL TABLE student_search USING fts5(
+                first_name, last_name, content='student',
+                content_rowid='rowid', tokenize='trigram')""",
+        ],
+        "triggers": {
+            "student_search_ai": """
+                CREATE TRIGGER IF NOT EXISTS student_search_ai
+                AFTER INSERT ON student BEGIN
+                    INSERT INTO student_search(rowid, first_name, last_name)
+                    VALUES (new.rowid, new.first_name, new.last_name);
+                END""",
+            "student_search_ad": """
+                CREATE TRIGGER IF NOT EXISTS student_search_ad
+                AFTER DELETE ON student BEGIN
+                    INSERT INTO student_search(
+                        student_search, rowid, first_name, last_name)
+                    VALUES ('delete', old.rowid, old.first_name,
+                            old.last_name);
+                END""",
+            "student_search_au": """
+                CREATE TRIGGER IF NOT EXISTS student_search_au
+                AFTER UPDATE OF first_name, last_name ON student BEGIN
+                    INSERT INTO student_search(
+                        student_search, rowid, first_name, last_name)
+                    VALUES ('delete', old.rowid, old.first_name,
+                            old.last_name);
+                    INSERT INTO student_search(rowid, first_name, last_name)
+                    VALUES (new.rowid, new.first_name, new.last_name);
+                END""",
+        },
+    },
+}
+
+# Trigrams cannot match anything shorter than three characters
+MIN_INDEXED_QUERY = 3
+
+school_search = table("school_search", column("rowid"), column("rank"))
+student_search = table("student_search", column("rowid"), column("rank"))
+
+
+def _existing(connection, kind):
+    stmt = text("SELECT name FROM sqlite_master WHERE type = :kind")
+    return set(connection.execute(stmt, {"kind": kind}).scalars())
+
+
+@event.listens_for(db.metadata, "after_create")
+def install_search_indexes(target, connection, **kw):
+    """Create missing search tables and triggers, indexing existing rows"""
+    if connection.dialect.name != "sqlite":
+        return
+    tables = _existing(connection, "table")
+    triggers = _existing(connection, "trigger")
+    for name, ddl in SEARCH_INDEXES.items():
+        stale = name not in tables or not triggers.issuperset(ddl["triggers"])
+        if name not in tables:
+            for statement in ddl["create"]:
+                connection.exec_driver_sql(statement)
+        for statement in ddl["triggers"].values():
+            connection.exec_driver_sql(statement)
+        if stale:
+            connection.exec_driver_sql(
+                    f"INSERT INTO {name}({name}) VALUES ('rebuild')")
+
+
+@event.listens_for(db.metadata, "before_drop")
+def drop_search_indexes(target, connection, **kw):
+    """Drop the search tables along with the tables they index"""
+    if connection.dialect.name != "sqlite":
+        return
+    for name in SEARCH_INDEXES:
+        connection.exec_driver_sql(f"DROP TABLE IF EXISTS {name}")
+
+
+def rebuild_search_indexes(connection):
+    """Reindex every search table from its content table"""
+    for name in SEARCH_INDEXES:
+        connection.exec_driver_sql(
+                f"INSERT INTO {name}({name}) VALUES ('rebuild')")
+
+
+@click.command("rebuild-search")
+@with_appcontext
+def rebuild_command():
+    """Reindex the search tables of every shard, needed after a VACUUM"""
+    for engine in db.engines.values():
+        if engine.dialect.name == "sqlite":
+            with engine.begin() as connection:
+                rebuild_search_indexes(connection)
+    click.echo("Rebuilt the search indexes")
+
+
+def init_app(app):
+    """Register the rebuild-search command"""
+    app.cli.add_command(rebuild_command)
+
+
+def _phrase(query):
+    """Quote a user query as a single FTS5 phrase"""
+    return '"' + query.replace('"', '""') + '"'
+
+
+def _use_index(query):
+    return (db.engine.dialect.name == "sqlite"
+            and len(query) >= MIN_INDEXED_QUERY)
+
+
+def search_rank(search_table, query):
+    """
+    Relevance a search statement orders by, to merge results of several
+    shards. Constant when it falls back to LIKE and so orders by id alone
+    """
+    if not _use_index(query):
+        return literal(0)
+    return search_table.c.rank
+
+
+def search_schools_stmt(query, limit):
+    """Schools whose name contains query, best matches first"""
+    if not _use_index(query):
+        return (select(School)
+                .where(School.name.ilike(f"%{query}%"))
+                .order_by(School.id)
+                .limit(limit))
+    return (select(School)
+            .join(school_search, school_search.c.rowid == School.id)
+            .where(literal_column("school_search").match(_phrase(query)))
+            .order_by(school_search.c.rank, School.id)
+            .limit(limit))
+
+
+def search_students_stmt(query, limit, *columns):
+    """
+    Students whose first or last name contains query, best matches first.
+    Selects the given columns, or whole Student entities by default
+    """
+    columns = columns or (Student,)
+    if not _use_index(query):
+        return (select(*columns)
+                .where(or_(
+                    Student.first_name.ilike(f"%{query}%"),
+                    Student.last_name.ilike(f"%{query}%"),
+                    ))
+                .order_by(Student.id)
+                .limit(limit))
+    return (select(*columns)
+            .join(student_search,
+                  student_search.c.rowid == literal_column("student.rowid"))
+            .where(literal_column("student_search").match(_phrase(query)))
+            .order_by(student_search.c.rank, Student.id)
+            .limit(limit))
@@ -0,0 +1,112 @@
+import heapq
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from contextvars import ContextVar, copy_context
+from itertools import count, islice
+from flask import current_app
+from flask_sqlalchemy.session import Session
+from ..cooperative import wait
+
+# A school and all of its students live in shard school_id % N. Shard 0 is
+# SQLALCHEMY_DATABASE_URI, shards 1 to N-1 the binds named shard1..shardN-1.
+# Revisions and the change log are kept per shard, next to the rows they
+# describe, so every write stays a single-database transaction.
+
+# Shard the session sends statements to, None for the default database
+_shard = ContextVar("shard", default=None)
+_placement = count()
+_pool_lock = threading.Lock()
+_pool = None
+_pool_pid = None
+
+SCATTER_WORKERS = 32
+
+
+def shard_key(shard):
+    """Bind key of a shard, None for shard 0"""
+    return f"shard{shard}" if shard else None
+
+
+def shard_count(app=None):
+    """Number of shards, 1 when no shard binds are configured"""
+    binds = (app or current_app).config.get("SQLALCHEMY_BINDS") or {}
+    return 1 + sum(1 for key in binds if key.startswith("shard"))
+
+
+def shard_of(school_id):
+    """Shard holding a school and its students"""
+    try:
+        return int(school_id) % shard_count()
+    except (TypeError, ValueError):
+        return 0
+
+
+def current_shard():
+    """Shard selected with on_shard, 0 outside of one"""
+    return _shard.get() or 0
+
+
+def place_school():
+    """Shard for a new school, spreading them round-robin"""
+    return next(_placement) % shard_count()
+
+
+@contextmanager
+def on_shard(shard):
+    """Send the statements of the session to a shard within the block"""
+    token = _shard.set(shard)
+    try:
+        yield
+    finally:
+        _shard.reset(token)
+
+
+class ShardSession(Session):
+    """Session using the engine of the shard selected with on_shard"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        shard = _shard.get()
+        if bind is None and shard:
+            return self._db.engines[shard_key(shard)]
+        return super().get_bind(mapper, clause, bind, **kwargs)
+
+
+def _executor():
+    # Created lazily so preloaded gunicorn workers each get their own
+    global _pool, _pool_pid
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            _pool_pid = os.getpid()
+            _pool = ThreadPoolExecutor(max_workers=SCATTER_WORKERS,
+                                       thread_name_prefix="scatter")
+        return _pool
+
+
+def _call(app, shard, func, args):
+    with app.app_context(), on_shard(shard):
+        return func(*args)
+
+
+def scatter(func, *args):
+    """
+    Call func(*args) on every shard in parallel, each in its own app context
+    and so its own session, returning the results in shard order. With a
+    single shard it is a plain call in the current session
+    """
+    shards = shard_count()
+    if shards == 1:
+        return [func(*args)]
+    app = current_app._get_current_object()
+    # Run in a copy of the caller's context so per request state, like a
+    # profile's SQL timeline, follows the calls
+    futures = [_executor().submit(copy_context().run, _call, app, shard,
+                                  func, args)
+               for shard in range(shards)]
+    return [wait(future) for future in futures]
+
+
+def merge(results, key, limit=None):
+    """Merge per shard lists each sorted by key, keeping the first limit"""
+    return list(islice(heapq.merge(*results, key=key), limit))
@@ -0,0 +1,54 @@
+from sqlalchemy import Float, case, cast, func, select
+from .models import db, School
+from .sharding import scatter
+
+# Share of seats taken, NULL for schools without capacity. Reads only the
+# stored student_count, so no query here ever touches the student table.
+utilization = case(
+        (School.capacity > 0,
+         cast(School.student_count, Float) / School.capacity),
+        else_=None,
+        )
+
+
+def _shard_totals():
+    stmt = select(
+            func.count(School.id),
+            func.coalesce(func.sum(School.capacity), 0),
+            func.coalesce(func.sum(School.student_count), 0),
+            )
+    return tuple(db.session.execute(stmt).one())
+
+
+def occupancy_totals():
+    """Schools, seats, students and overall utilization, one query a shard"""
+    schools, capacity, students = map(sum, zip(*scatter(_shard_totals)))
+    return {
+        "schools": schools,
+        "capacity": capacity,
+        "student_count": students,
+        "utilization": students / capacity if capacity else None,
+    }
+
+
+def _shard_histogram(bounds):
+    bucket = case(
+            *[(utilization <= bound, index)
+              for index, bound in enumerate(bounds)],
+            else_=len(bounds) - 1,
+            ).label("bucket")
+    stmt = (select(bucket, func.count())
+            .where(School.capacity > 0)
+            .group_by(bucket))
+    return dict(db.session.execute(stmt).all())
+
+
+def utilization_histogram(bounds):
+    """
+    Schools per utilization bucket, one GROUP BY query a shard. Each bucket
+    counts the schools above the previous bound and up to its own
+    """
+    counts = scatter(_shard_histogram, bounds)
+    return [{"upto": bound,
+             "schools": sum(shard.get(index, 0) for shard in counts)}
+            for index, bound in enumerate(bounds)]
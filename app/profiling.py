@@ -0,0 +1,246 @@
+import cProfile
+import hmac
+import json
+import os
+import pstats
+import random
+import threading
+import time
+import uuid
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from flask import g, jsonify, request, send_from_directory
+from sqlalchemy import event
+from .models.models import db
+
+# Functions listed in a report, by cumulative time
+TOP_FUNCTIONS = 30
+# Timeline of the request being profiled, None for every other request
+_timeline = ContextVar("profile_timeline", default=None)
+# cProfile hooks the thread it runs on, and from Python 3.12 the whole
+# interpreter, so only one request per process is profiled at a time
+_profiling = threading.Lock()
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context,
+                           executemany):
+    if _timeline.get() is not None:
+        conn.info.setdefault("profile_start", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    timeline = _timeline.get()
+    if timeline is None:
+        return
+    start = conn.info["profile_start"].pop()
+    # Parameters are left out, they carry students' personal data
+    timeline.append({
+        "start": start,
+        "duration_ms": (time.perf_counter() - start) * 1000,
+        "database": str(conn.engine.url),
+        "statement": statement,
+        "executemany": executemany,
+    })
+
+
+def authorized(app):
+    """Whether the request sends PROFILE_TOKEN, never when it is unset"""
+    value = request.headers.get(app.config["PROFILE_HEADER"])
+    token = app.config.get("PROFILE_TOKEN")
+    return bool(value and token) and hmac.compare_digest(value, token)
+
+
+def triggered(app):
+    """How the current request asked to be profiled, None when it did not"""
+    if authorized(app):
+        return "header"
+    rate = app.config.get("PROFILE_SAMPLE_RATE")
+    if rate and random.random() * 100 < rate:
+        return "sample"
+    return None
+
+
+def top_functions(profiler, limit=TOP_FUNCTIONS):
+    """The functions the request spent the most cumulative time in"""
+    stats = pstats.Stats(profiler).stats
+    rows = sorted(stats.items(), key=lambda item: item[1][3], reverse=True)
+    return [{
+        "function": pstats.func_std_string(func),
+        "calls": calls,
+        "own_ms": own * 1000,
+        "cumulative_ms": cumulative * 1000,
+    } for func, (_, calls, own, cumulative, _) in rows[:limit]]
+
+
+class ProfileStore:
+    """Reports in a directory, each a JSON summary next to its pstats dump"""
+
+    def __init__(self, directory, keep):
+        self.directory = os.path.abspath(directory)
+        self.keep = keep
+        os.makedirs(self.directory, exist_ok=True)
+
+    def save(self, report, profiler):
+        profiler.dump_stats(os.path.join(self.directory,
+                                         report["id"] + ".prof"))
+        # Written last, so a report is only listed once its dump exists
+        path = os.path.join(self.directory, report["id"] + ".json")
+        with open(path + ".tmp", "w") as file:
+            json.dump(report, file)
+        os.replace(path + ".tmp", path)
+        self.prune()
+
+    def ids(self):
+        """Saved reports, newest first"""
+        return sorted((name[:-5] for name in os.listdir(self.directory)
+                       if name.endswith(".json")), reverse=True)
+
+    def load(self, profile_id):
+        """A saved report, None when there is none with that id"""
+        if profile_id not in self.ids():
+            return None
+        return self._read(profile_id)
+
+    def _read(self, profile_id):
+        path = os.path.join(self.directory, profile_id + ".json")
+        try:
+            with open(path) as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return None
+
+    def summaries(self):
+        """Every saved report without its timeline and functions"""
+        summaries = []
+        for profile_id in self.ids():
+            # None when another worker pruned it since it was listed
+            report = self._read(profile_id)
+            if report is not None:
+                del report["timeline"], report["functions"]
+                summaries.append(report)
+        return summaries
+
+    def prune(self):
+        for profile_id in self.ids()[self.keep:]:
+            for extension in (".json", ".prof"):
+                try:
+                    os.remove(os.path.join(self.directory,
+                                           profile_id + extension))
+                except FileNotFoundError:
+                    pass
+
+
+def init_app(app):
+    """
+    Profile requests asking for it with PROFILE_HEADER, or a sampled
+    PROFILE_SAMPLE_RATE percent of them, saving to PROFILE_DIR a cProfile
+    dump and a report with the SQL timeline. Recent reports are listed at
+    /profiles. Without PROFILE_TOKEN requests are only sampled and the
+    reports are not served. Nothing is registered when PROFILING_ENABLED is
+    off, and other requests only pay the trigger check
+    """
+    if not app.config.get("PROFILING_ENABLED"):
+        return
+    # Reports show SQL and code paths, so without a token to guard them
+    # they are only written to PROFILE_DIR
+    serve_reports = bool(app.config.get("PROFILE_TOKEN"))
+    if not serve_reports:
+        app.logger.warning("PROFILE_TOKEN is not set, profiles are only "
+                           "sampled and the /profiles routes are disabled")
+
+    store = ProfileStore(app.config["PROFILE_DIR"], app.config["PROFILE_KEEP"])
+    app.extensions["profiles"] = store
+
+    with app.app_context():
+        for engine in db.engines.values():
+            event.listen(engine, "before_cursor_execute",
+                         _before_cursor_execute)
+            event.listen(engine, "after_cursor_execute",
+                         _after_cursor_execute)
+
+    @app.before_request
+    def start_profile():
+        if request.endpoint and request.endpoint.startswith("profile_"):
+            if not authorized(app):
+                return jsonify({"error": "Profile token required"}), 403
+            return
+        trigger = triggered(app)
+        if trigger is None or not _profiling.acquire(blocking=False):
+            return
+        started = datetime.now(timezone.utc)
+        g.profile = {
+            "trigger": trigger,
+            # Sorts by start time, the suffix tells workers' profiles apart
+            "id": started.strftime("%Y%m%dT%H%M%S%f-") + uuid.uuid4().hex[:8],
+            "started": started.isoformat(),
+            "start": time.perf_counter(),
+            "profiler": cProfile.Profile(),
+        }
+        _timeline.set([])
+        g.profile["profiler"].enable()
+
+    def stop_profile():
+        profile = g.pop("profile")
+        profile["profiler"].disable()
+        timeline = _timeline.get()
+        _timeline.set(None)
+        _profiling.release()
+        return profile, timeline
+
+    @app.after_request
+    def save_profile(response):
+        if "profile" not in g:
+            return response
+        profile, timeline = stop_profile()
+        duration = time.perf_counter() - profile["start"]
+        for entry in timeline:
+            entry["start_ms"] = (entry.pop("start") - profile["start"]) * 1000
+        report = {
+            "id": profile["id"],
+            "started": profile["started"],
+            "trigger": profile["trigger"],
+            "method": request.method,
+            # Without the query string, which can hold searched names
+            "path": request.path,
+            "endpoint": request.endpoint,
+            "status": response.status_code,
+            "duration_ms": duration * 1000,
+            "statements": len(timeline),
+            "sql_ms": sum(entry["duration_ms"] for entry in timeline),
+            "timeline": timeline,
+            "functions": top_functions(profile["profiler"]),
+        }
+        store.save(report, profile["profiler"])
+        response.headers["X-Profile-Id"] = report["id"]
+        return response
+
+    @app.teardown_request
+    def discard_profile(error):
+        # Only left behind when after_request did not run to the end
+        if "profile" in g:
+            stop_profile()
+
+    if not serve_reports:
+        return
+
+    @app.route("/profiles")
+    def profile_index():
+        """List the saved profiles, newest first"""
+        return jsonify(store.summaries())
+
+    @app.route("/profiles/<profile_id>")
+    def profile_report(profile_id):
+        """A saved profile with its SQL timeline and slowest functions"""
+        report = store.load(profile_id)
+        if report is None:
+            return jsonify({"error": "Profile not found"}), 404
+        return jsonify(report)
+
+    @app.route("/profiles/<profile_id>/pstats")
+    def profile_dump(profile_id):
+        """The cProfile dump of a saved profile, for pstats or snakeviz"""
+        if store.load(profile_id) is None:
+            return jsonify({"error": "Profile not found"}), 404
+        return send_from_directory(store.directory, profile_id + ".prof",
+                                   as_attachment=True)
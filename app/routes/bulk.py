@@ -0,0 +1,349 @@
+import json
+from collections import Counter, defaultdict
+from itertools import islice
+from sqlalchemy import select, insert, delete, update, func, literal
+from sqlalchemy.exc import IntegrityError
+from ..models.models import (
+        db,
+        School,
+        Student,
+        take_seats,
+        release_seats,
+        bump_revisions,
+        record_changes,
+        claim_keys,
+        release_keys,
+        Change,
+        )
+from ..models.sharding import (
+        scatter,
+        shard_count,
+        shard_of,
+        current_shard,
+        on_shard,
+        )
+from .writes import Rejected
+
+STUDENT_FIELDS = ('id', 'first_name', 'last_name', 'school_id')
+ATTEMPTS = 3
+
+
+class SeatsTaken(Exception):
+    """Seats counted for a chunk were claimed by a concurrent writer"""
+
+
+def read_ndjson(stream):
+    """Yield one decoded object per non-blank line, or None if malformed"""
+    for line in stream:
+        if not line.strip():
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError:
+            yield None
+
+
+def _chunks(iterable, size):
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def _result(index, row, status, error=None):
+    result = {"index": index, "id": row.get("id"), "status": status}
+    if error:
+        result["error"] = error
+    return result
+
+
+def _valid_text(value, column):
+    """Whether value is a non-empty string that fits in a String column"""
+    return (isinstance(value, str) and value != ""
+            and len(value) <= column.type.length)
+
+
+def _validate(index, row):
+    """Return a failed result for a malformed row, None when it is valid"""
+    if not isinstance(row, dict):
+        return _result(index, {}, 400, "Invalid row")
+    if not all(field in row for field in STUDENT_FIELDS):
+        return _result(index, row, 400, "Missing required fields")
+    for field in ('id', 'first_name', 'last_name'):
+        if not _valid_text(row[field], Student.__table__.c[field]):
+            return _result(index, row, 400, f"Invalid {field}")
+    # Exactly an int: no floats, booleans or numeric strings
+    if type(row["school_id"]) is not int:
+        return _result(index, row, 400, "Invalid school_id")
+    return None
+
+
+def _free_seats(school_ids):
+    """Remaining capacity of each school, in one query"""
+    stmt = (
+        select(School.id, School.capacity - School.student_count)
+        .where(School.id.in_(school_ids))
+    )
+    return dict(db.session.execute(stmt).all())
+
+
+def _existing_ids(ids):
+    """The given student IDs already taken, in one query"""
+    stmt = select(Student.id).where(Student.id.in_(ids))
+    return set(db.session.execute(stmt).scalars())
+
+
+def _import_chunk(chunk):
+    """Check and insert one chunk of (index, row) pairs in a transaction"""
+    # Bumped first so the checks below read under the write lock, where no
+    # concurrent import can claim the seats they count
+    bump_revisions("schools", "students")
+    existing = _existing_ids([row["id"] for _, row in chunk])
+    seats = _free_seats({row["school_id"] for _, row in chunk})
+
+    results = []
+    accepted = []
+    claimed = {}
+    for index, row in chunk:
+        school_id = row["school_id"]
+        if row["id"] in existing:
+            results.append(_result(index, row, 409,
+                                   "Student ID already exists"))
+        elif school_id not in seats:
+            results.append(_result(index, row, 404, "School not found"))
+        elif seats[school_id] <= 0:
+            results.append(_result(index, row, 403,
+                                   "School is at maximum capacity"))
+        else:
+            seats[school_id] -= 1
+            claimed[school_id] = claimed.get(school_id, 0) + 1
+            accepted.append({field: row[field] for field in STUDENT_FIELDS})
+            results.append(_result(index, row, 201))
+
+    for school_id, seats_taken in claimed.items():
+        if not take_seats(school_id, seats_taken):
+            raise SeatsTaken(school_id)
+    if accepted:
+        db.session.execute(insert(Student), accepted)
+        record_changes("students", "created",
+                       [(row["id"], row["school_id"]) for row in accepted])
+    db.session.commit()
+    return results
+
+
+def _import_with_retry(chunk):
+    for attempt in range(ATTEMPTS):
+        try:
+            return _import_chunk(chunk)
+        except SeatsTaken:
+            # A concurrent writer got there first, recheck against its rows
+            db.session.rollback()
+            if attempt == ATTEMPTS - 1:
+                raise
+        except IntegrityError:
+            db.session.rollback()
+            # Only a concurrent insert of one of the IDs is worth a retry,
+            # which then reports it as taken. Anything else is a bug
+            if (attempt == ATTEMPTS - 1
+                    or not _existing_ids([row["id"] for _, row in chunk])):
+                raise
+
+
+def _import_shard(by_shard):
+    chunk = by_shard.get(current_shard())
+    return _import_with_retry(chunk) if chunk else []
+
+
+def _import_sharded(chunk):
+    """
+    Import a chunk with each row on the shard of its school, all shards at
+    once. IDs are claimed first, as each shard only enforces uniqueness
+    among its own students, and the claims of rows not created given back
+    """
+    if shard_count() == 1:
+        return _import_with_retry(chunk)
+    claimed = claim_keys("students", [row["id"] for _, row in chunk])
+    # IDs given before claims were taken are only found on the shards
+    taken = set().union(*scatter(_existing_ids, list(claimed)))
+    results = []
+    by_shard = defaultdict(list)
+    for index, row in chunk:
+        if row["id"] not in claimed or row["id"] in taken:
+            results.append(_result(index, row, 409,
+                                   "Student ID already exists"))
+        else:
+            by_shard[shard_of(row["school_id"])].append((index, row))
+    # Should a shard fail, the claims are kept, as others may have committed
+    for shard_results in scatter(_import_shard, by_shard):
+        results.extend(shard_results)
+    release_keys("students", {result["id"] for result in results
+                              if result["status"] != 201} & claimed)
+    return results
+
+
+def import_students(rows, chunk_size):
+    """
+    Insert students in chunked transactions, returning one result per row
+    in input order. Rows are checked against existing IDs and remaining
+    school capacity once per chunk rather than once per row.
+    """
+    results = []
+    accepted = set()
+    for chunk in _chunks(enumerate(rows), chunk_size):
+        pending = []
+        for index, row in chunk:
+            failure = _validate(index, row)
+            if failure:
+                results.append(failure)
+            else:
+                pending.append((index, row))
+        # A repeated ID waits for its earlier row, and only conflicts once
+        # that one was accepted: a row failing for its school frees the ID
+        while pending:
+            batch, later, ids = [], [], set()
+            for index, row in pending:
+                if row["id"] in accepted:
+                    results.append(_result(index, row, 409,
+                                           "Student ID already exists"))
+                elif row["id"] in ids:
+                    later.append((index, row))
+                else:
+                    ids.add(row["id"])
+                    batch.append((index, row))
+            for result in _import_sharded(batch):
+                if result["status"] == 201:
+                    accepted.add(result["id"])
+                results.append(result)
+            pending = later
+
+    results.sort(key=lambda result: result["index"])
+    return results
+
+
+def _delete_on_shard(ids, chunk_size):
+    deleted = set()
+    bump_revisions("schools", "students")
+    for chunk in _chunks(ids, chunk_size):
+        stmt = (
+            delete(Student)
+            .where(Student.id.in_(chunk))
+            .returning(Student.id, Student.school_id)
+        )
+        rows = db.session.execute(
+                stmt, execution_options={"synchronize_session": False}).all()
+        released = Counter(row.school_id for row in rows)
+        for school_id, seats in released.items():
+            release_seats(school_id, seats)
+        record_changes("students", "deleted", rows)
+        deleted.update(row.id for row in rows)
+    db.session.commit()
+    return deleted
+
+
+def delete_students(ids, chunk_size):
+    """
+    Delete the given students with one DELETE ... RETURNING per chunk and
+    shard, releasing their seats per school. Returns the IDs that did not
+    exist.
+    """
+    ids = list(dict.fromkeys(ids))
+    deleted = set().union(*scatter(_delete_on_shard, ids, chunk_size))
+    release_keys("students", deleted)
+    return [student_id for student_id in ids if student_id not in deleted]
+
+
+def _enrolled(filters):
+    """Students matching each filter, counted per school in one query each"""
+    counts = Counter()
+    for condition in filters:
+        stmt = (
+            select(Student.school_id, func.count())
+            .where(condition)
+            .group_by(Student.school_id)
+        )
+        counts.update(dict(db.session.execute(stmt).all()))
+    return counts
+
+
+def _missing_ids(ids, chunk_size):
+    found = set()
+    for chunk in _chunks(ids, chunk_size):
+        found.update(*scatter(_existing_ids, chunk))
+    return [student_id for student_id in ids if student_id not in found]
+
+
+def _move(condition, school_id):
+    """Log and move the students matching condition with set statements"""
+    moving = (Student.school_id != school_id, condition)
+    # Logged as leaving one school and joining the other, which is how
+    # consumers of the change log already track a student's school
+    for action, school in (("deleted", Student.school_id),
+                           ("created", literal(school_id))):
+        db.session.execute(insert(Change).from_select(
+                ["resource", "action", "resource_id", "school_id"],
+                select(literal("students"), literal(action), Student.id,
+                       school)
+                .where(*moving)))
+    db.session.execute(
+            update(Student).where(*moving).values(school_id=school_id),
+            execution_options={"synchronize_session": False})
+
+
+def _transfer(filters, school_id, from_school_id, expected):
+    """Moved count, or None when fewer than expected students were found"""
+    bump_revisions("schools", "students")
+    if from_school_id is not None and not db.session.get(School,
+                                                         from_school_id):
+        raise Rejected(404, "School not found")
+    counts = _enrolled(filters)
+    if expected is not None and sum(counts.values()) < expected:
+        return None
+    counts.pop(school_id, None)
+    moved = sum(counts.values())
+
+    if not take_seats(school_id, moved):
+        if not db.session.get(School, school_id):
+            raise Rejected(404, "School not found")
+        raise Rejected(403, "School is at maximum capacity")
+    for source, seats in counts.items():
+        release_seats(source, seats)
+    for condition in filters:
+        _move(condition, school_id)
+    return moved
+
+
+def move_students(school_id, chunk_size, ids=None, from_school_id=None):
+    """
+    Move the given students, or every student of from_school_id, to a
+    school in one transaction. Capacity is checked once for the whole
+    move, and students are moved with one UPDATE per chunk of IDs, or a
+    single one for a whole school. Returns how many students changed
+    school, raising Rejected, with nothing moved, when a student or school
+    does not exist, the target lacks room, or the students are on another
+    shard than the target.
+    """
+    shard = shard_of(school_id)
+    if ids is not None:
+        ids = list(dict.fromkeys(ids))
+        filters = [Student.id.in_(chunk) for chunk in _chunks(ids, chunk_size)]
+        expected = len(ids)
+    else:
+        if shard_of(from_school_id) != shard:
+            raise Rejected(400, "Schools are on different shards")
+        filters = [Student.school_id == from_school_id]
+        expected = None
+
+    with on_shard(shard):
+        try:
+            moved = _transfer(filters, school_id, from_school_id, expected)
+        except Rejected:
+            db.session.rollback()
+            raise
+        if moved is None:
+            db.session.rollback()
+            missing = _missing_ids(ids, chunk_size)
+            if missing:
+                raise Rejected(404, "Student not found", missing=missing)
+            raise Rejected(400, "Students are on a different shard than "
+                                "the school")
+        db.session.commit()
+    return moved
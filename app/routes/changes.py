@@ -0,0 +1,171 @@
+import time
+import click
+from flask import current_app, stream_with_context
+from flask.cli import with_appcontext
+from sqlalchemy import delete, func, select
+from ..cooperative import sleep
+from ..models.models import db, Change
+from ..models.sharding import scatter, shard_count, current_shard
+from .helpers import dumps
+
+# Each shard keeps its own log, so a cursor holds one position per shard.
+# With a single shard it is the plain id of the last change seen.
+
+
+def parse_cursor(value):
+    """Positions of a cursor, one per shard. Raises ValueError if malformed"""
+    positions = [int(part) for part in str(value).split(".")]
+    shards = shard_count()
+    if positions == [0]:
+        return [0] * shards
+    if len(positions) != shards:
+        raise ValueError("cursor does not match the shards")
+    return positions
+
+
+def format_cursor(positions):
+    """Cursor of per shard positions, an int when there is a single shard"""
+    if len(positions) == 1:
+        return positions[0]
+    return ".".join(str(position) for position in positions)
+
+
+def serialize_change(row, cursor):
+    """Format a change log row to dict, with the cursor just past it"""
+    resource_id = row.resource_id
+    if row.resource == "schools":
+        resource_id = int(resource_id)
+    return {
+        "cursor": cursor,
+        "resource": row.resource,
+        "action": row.action,
+        "id": resource_id,
+        "school_id": row.school_id,
+    }
+
+
+def _shard_changes(positions, limit):
+    stmt = (
+        select(Change.id, Change.resource, Change.action, Change.resource_id,
+               Change.school_id)
+        .where(Change.id > positions[current_shard()])
+        .order_by(Change.id)
+        .limit(limit)
+    )
+    return db.session.execute(stmt).all()
+
+
+def changes_since(positions, limit):
+    """
+    Up to limit changes after the given positions, oldest first within each
+    shard, and the positions after the last of them
+    """
+    positions = list(positions)
+    changes = []
+    for shard, rows in enumerate(scatter(_shard_changes, positions, limit)):
+        for row in rows[:limit - len(changes)]:
+            positions[shard] = row.id
+            changes.append(serialize_change(row, format_cursor(positions)))
+    return changes, positions
+
+
+def _shard_latest():
+    return db.session.execute(select(func.max(Change.id))).scalar() or 0
+
+
+def latest_cursor():
+    """Positions of the newest change of each shard, 0 while a log is empty"""
+    return scatter(_shard_latest)
+
+
+def _shard_oldest():
+    return db.session.execute(select(func.min(Change.id))).scalar()
+
+
+def expired(positions):
+    """
+    Whether a cursor points before the oldest retained change of a shard,
+    so the entries right after it were pruned. 0 always reads from the
+    oldest retained change
+    """
+    if not any(positions):
+        return False
+    return any(oldest is not None and 0 < position < oldest - 1
+               for position, oldest in zip(positions, scatter(_shard_oldest)))
+
+
+def _prune_shard(keep):
+    newest = _shard_latest()
+    pruned = db.session.execute(
+            delete(Change).where(Change.id <= newest - keep),
+            execution_options={"synchronize_session": False}).rowcount
+    db.session.commit()
+    return pruned
+
+
+def prune_changes(keep):
+    """Delete all but the newest keep changes of each shard"""
+    return sum(scatter(_prune_shard, keep))
+
+
+@click.command("prune-changes")
+@with_appcontext
+@click.option("--keep", type=int, default=None,
+              help="Changes kept per shard, CHANGES_RETENTION by default.")
+def prune_command(keep):
+    """Delete the oldest entries of the change log"""
+    if keep is None:
+        keep = current_app.config["CHANGES_RETENTION"]
+    if not keep:
+        click.echo("CHANGES_RETENTION is 0, every change is kept")
+        return
+    click.echo(f"Pruned {prune_changes(keep)} changes")
+
+
+def init_app(app):
+    """Register the prune-changes command"""
+    app.cli.add_command(prune_command)
+
+
+def _events(positions, timeout):
+    config = current_app.config
+    limit = config["CHANGES_PAGE_SIZE"]
+    deadline = time.monotonic() + timeout
+    quiet_since = time.monotonic()
+    while True:
+        changes, positions = changes_since(positions, limit)
+        # End the read transaction so the next poll sees later commits
+        db.session.rollback()
+        if changes:
+            quiet_since = time.monotonic()
+            yield b"".join(
+                    b"id: %s\nevent: change\ndata: %s\n\n"
+                    % (str(change["cursor"]).encode(), dumps(change))
+                    for change in changes)
+            if len(changes) == limit:
+                continue
+
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return
+        if time.monotonic() - quiet_since >= config["CHANGES_HEARTBEAT"]:
+            quiet_since = time.monotonic()
+            yield b": keepalive\n\n"
+        sleep(min(config["CHANGES_POLL_INTERVAL"], remaining))
+
+
+def event_stream(positions, timeout):
+    """
+    Server-Sent Events response with every change after the cursor
+    positions, polling the log for new ones until timeout seconds have
+    passed. Clients reconnect with Last-Event-ID to resume where the stream
+    ended
+    """
+    return current_app.response_class(
+            stream_with_context(_events(positions, timeout)),
+            mimetype="text/event-stream",
+            headers={
+                "Cache-Control": "no-cache",
+                "X-Accel-Buffering": "no",
+            },
+            )
@@ -0,0 +1,88 @@
+import csv
+import heapq
+import io
+import zlib
+from itertools import islice
+from operator import itemgetter
+from flask import current_app, request, stream_with_context
+from ..models.models import db
+from ..models.sharding import on_shard, shard_count
+from .helpers import dumps
+
+EXPORT_FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+
+
+def _ndjson(columns, partitions):
+    for rows in partitions:
+        yield b"".join(dumps(dict(zip(columns, row))) + b"\n"
+                       for row in rows)
+
+
+def _csv(columns, partitions):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    yield buffer.getvalue().encode()
+    for rows in partitions:
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows(rows)
+        yield buffer.getvalue().encode()
+
+
+def _merged(results, size):
+    """Partitions of size rows merged from every shard on the first column"""
+    rows = heapq.merge(*results, key=itemgetter(0))
+    while batch := list(islice(rows, size)):
+        yield batch
+
+
+def _gzip(chunks):
+    """Compress a byte stream on the fly, flushing after every chunk"""
+    compressor = zlib.compressobj(wbits=zlib.MAX_WBITS | 16)
+    for chunk in chunks:
+        yield compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    yield compressor.flush()
+
+
+def export_response(stmt, name):
+    """
+    Stream every row of stmt as NDJSON or CSV, per the format query
+    parameter, gzipped when the client accepts it. Rows are fetched
+    EXPORT_BATCH_SIZE at a time so memory stays flat whatever the table
+    size. Sharded tables are streamed from every shard at once, merged on
+    the first column of stmt, which must also be its ordering. Raises
+    ValueError on an unknown format
+    """
+    fmt = request.args.get("format", "ndjson")
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError("unknown export format")
+
+    size = current_app.config["EXPORT_BATCH_SIZE"]
+    stmt = stmt.execution_options(yield_per=size)
+    results = []
+    for shard in range(shard_count()):
+        with on_shard(shard):
+            results.append(db.session.execute(stmt))
+    if len(results) == 1:
+        partitions = results[0].partitions()
+    else:
+        partitions = _merged(results, size)
+    encode = _csv if fmt == "csv" else _ndjson
+    chunks = encode(list(results[0].keys()), partitions)
+
+    headers = {
+        "Content-Disposition": f"attachment; filename={name}.{fmt}",
+        "Vary": "Accept-Encoding",
+    }
+    if request.accept_encodings["gzip"]:
+        chunks = _gzip(chunks)
+        headers["Content-Encoding"] = "gzip"
+    return current_app.response_class(
+            stream_with_context(chunks),
+            mimetype=EXPORT_FORMATS[fmt],
+            headers=headers,
+            )
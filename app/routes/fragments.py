@@ -0,0 +1,65 @@
+import threading
+from collections import OrderedDict
+from flask import current_app
+
+
+class FragmentCache:
+    """
+    Encoded JSON of whole schools, students included, keyed by id and
+    tagged with the School.version it encodes. Any write to a school or its
+    students gives it a new version, so only that school's entry goes stale.
+    Least recently used entries are evicted past max_bytes
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+
+    def get(self, school_id, version):
+        """The cached fragment of this version of a school, or None"""
+        with self.lock:
+            entry = self.entries.get(school_id)
+            if entry is None or entry[0] != version:
+                return None
+            self.entries.move_to_end(school_id)
+            return entry[1]
+
+    def put(self, school_id, version, fragment):
+        with self.lock:
+            self._drop(school_id)
+            if len(fragment) > self.max_bytes:
+                return
+            self.entries[school_id] = (version, fragment)
+            self.size += len(fragment)
+            while self.size > self.max_bytes:
+                _, (_, evicted) = self.entries.popitem(last=False)
+                self.size -= len(evicted)
+
+    def discard(self, school_id):
+        """Forget a school, freeing its memory before it would be evicted"""
+        with self.lock:
+            self._drop(school_id)
+
+    def _drop(self, school_id):
+        entry = self.entries.pop(school_id, None)
+        if entry is not None:
+            self.size -= len(entry[1])
+
+
+def fragments_response(fragments, next_cursor=None):
+    """page_response for a list of already encoded items"""
+    response = current_app.response_class(
+            b"[" + b",".join(fragments) + b"]",
+            mimetype="application/json")
+    if next_cursor is not None:
+        response.headers["X-Next-Cursor"] = str(next_cursor)
+    return response
+
+
+def init_app(app):
+    """Register the fragment cache unless SCHOOL_FRAGMENT_CACHE_BYTES is 0"""
+    max_bytes = app.config.get("SCHOOL_FRAGMENT_CACHE_BYTES")
+    if max_bytes:
+        app.extensions["school_fragments"] = FragmentCache(max_bytes)
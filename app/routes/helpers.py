@@ -1,3 +1,11 @@
+import json
+from flask import current_app, request
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 def serialize_student(student):
     """Format student object to dict"""
     return {
@@ -7,14 +15,123 @@ def serialize_student(student):
         "school_id": student.school_id
     }
 
+def serialize_rows(rows):
+    """Format projected rows to dicts, skipping ORM object hydration"""
+    if not rows:
+        return []
+    fields = rows[0]._fields
+    return [dict(zip(fields, row)) for row in rows]
+
 def serialize_school(school, include_students=True):
     """Format school object to dict, optionally nesting students."""
     data = {
         "id": school.id,
         "name": school.name,
         "capacity": school.capacity,
-        "student_count": len(school.students)
+        "student_count": school.student_count
     }
     if include_students:
         data["students"] = [serialize_student(s) for s in school.students]
     return data
+
+# Fields a client may ask for with ?fields=, id is always returned
+SCHOOL_FIELDS = ("id", "name", "capacity", "student_count")
+
+def parse_school_shape(args):
+    """
+    Read fields and include from the query string. Returns the school
+    fields to select and whether to embed students, which is the full
+    representation when neither is given. Raises ValueError on unknown names
+    """
+    fields = args.get("fields")
+    include = args.get("include")
+    if fields is None and include is None:
+        return SCHOOL_FIELDS, True
+
+    requested = set(SCHOOL_FIELDS)
+    if fields is not None:
+        requested = {name for name in fields.split(",") if name}
+    embeds = {name for name in (include or "").split(",") if name}
+    if not requested <= set(SCHOOL_FIELDS) or not embeds <= {"students"}:
+        raise ValueError("unknown field")
+    names = tuple(name for name in SCHOOL_FIELDS
+                  if name == "id" or name in requested)
+    return names, "students" in embeds
+
+def parse_limit(args, default=None):
+    """
+    Read the limit from the query string. Raises ValueError when it is
+    malformed or outside 1..PAGE_SIZE_MAX
+    """
+    limit = args.get("limit")
+    if limit is None:
+        return default
+    limit = int(limit)
+    if not 1 <= limit <= current_app.config["PAGE_SIZE_MAX"]:
+        raise ValueError("limit out of range")
+    return limit
+
+def parse_page_args(args, cursor_type):
+    """
+    Read the limit and after cursor from the query string. Raises
+    ValueError when either is malformed or limit exceeds PAGE_SIZE_MAX
+    """
+    limit = parse_limit(args)
+    after = args.get("after")
+    if after is not None:
+        after = cursor_type(after)
+    return limit, after
+
+def parse_id_list(data):
+    """
+    Read the student IDs of an {"ids": [...]} body. Raises ValueError
+    unless it holds a list of strings
+    """
+    ids = data.get("ids") if isinstance(data, dict) else None
+    if (not isinstance(ids, list)
+            or not all(isinstance(student_id, str) for student_id in ids)):
+        raise ValueError("expected a list of IDs")
+    return ids
+
+def paginate(stmt, key, limit, after):
+    """Apply keyset pagination on key, fetching one extra row as lookahead"""
+    stmt = stmt.order_by(key)
+    if after is not None:
+        stmt = stmt.where(key > after)
+    if limit is not None:
+        stmt = stmt.limit(limit + 1)
+    return stmt
+
+def split_page(rows, limit):
+    """Drop the lookahead row, returning the page and whether more follow"""
+    if limit is None or len(rows) <= limit:
+        return rows, False
+    return rows[:limit], True
+
+def dumps(payload):
+    """Encode to compact JSON bytes, with orjson when it is installed"""
+    if orjson is not None:
+        return orjson.dumps(payload)
+    return json.dumps(payload, separators=(",", ":")).encode()
+
+def json_response(payload):
+    """JSON response encoded with the fast encoder"""
+    return current_app.response_class(dumps(payload),
+                                      mimetype="application/json")
+
+def page_response(items, next_cursor=None):
+    """JSON list response carrying the next cursor, if any, as a header"""
+    response = json_response(items)
+    if next_cursor is not None:
+        response.headers["X-Next-Cursor"] = str(next_cursor)
+    return response
+
+def is_fresh(etag):
+    """Whether the copy named in If-None-Match is still current"""
+    return request.if_none_match.contains_weak(etag)
+
+def not_modified(etag):
+    """Empty 304 response confirming the client's cached copy"""
+    response = current_app.response_class(status=304)
+    response.set_etag(etag)
+    return response
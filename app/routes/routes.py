@@ -1,12 +1,189 @@
-from flask import Blueprint, request, jsonify
-from sqlalchemy import select, or_
-from sqlalchemy.exc import IntegrityError
-from ..models.models import db, School, Student
-from .helpers import serialize_school, serialize_student
+from operator import itemgetter
+from flask import Blueprint, current_app, request, jsonify
+from sqlalchemy import select, insert, delete, literal
+from ..models.models import (
+        db,
+        School,
+        Student,
+        release_seats,
+        claim_keys,
+        release_keys,
+        Change,
+        bump_revisions,
+        record_changes,
+        revision_tag,
+        )
+from ..models.search import (
+        search_schools_stmt,
+        search_students_stmt,
+        search_rank,
+        school_search,
+        student_search,
+        )
+from ..models.sharding import (
+        scatter,
+        merge,
+        on_shard,
+        shard_of,
+        shard_count,
+        place_school,
+        )
+from ..models.stats import utilization, occupancy_totals, utilization_histogram
+from .helpers import (
+        serialize_school,
+        serialize_student,
+        serialize_rows,
+        json_response,
+        dumps,
+        parse_limit,
+        parse_page_args,
+        parse_school_shape,
+        SCHOOL_FIELDS,
+        parse_id_list,
+        paginate,
+        split_page,
+        page_response,
+        is_fresh,
+        not_modified,
+        )
+from .bulk import (
+        import_students,
+        delete_students,
+        move_students,
+        read_ndjson,
+        )
+from .export import export_response
+from .fragments import fragments_response
+from .changes import (
+        changes_since,
+        expired,
+        latest_cursor,
+        event_stream,
+        parse_cursor,
+        format_cursor,
+        )
+from .writes import add_school, add_student, Rejected
+from ..batching import perform
+from ..cache import record_cache
 
 
 api_blueprint = Blueprint('api', __name__)
 
+# Listings select plain rows instead of hydrating Student objects
+STUDENT_COLUMNS = (
+    Student.id,
+    Student.first_name,
+    Student.last_name,
+    Student.school_id,
+)
+
+def embed_students(schools):
+    """Nest the students of already serialized schools, with one query"""
+    if not schools:
+        return schools
+    by_school = {school["id"]: [] for school in schools}
+    for school in schools:
+        school["students"] = by_school[school["id"]]
+    stmt = (select(*STUDENT_COLUMNS)
+            .where(Student.school_id.in_(by_school))
+            .order_by(Student.school_id, Student.id))
+    for student in serialize_rows(db.session.execute(stmt).all()):
+        by_school[student["school_id"]].append(student)
+    return schools
+
+def _shard_page(stmt, key, limit, after, include_students):
+    rows = db.session.execute(paginate(stmt, key, limit, after)).all()
+    items = serialize_rows(rows)
+    return embed_students(items) if include_students else items
+
+def sharded_page(stmt, key, limit, after, include_students=False):
+    """
+    One keyset page of stmt merged from every shard, as dicts, and whether
+    more follow. Each shard is asked for a whole page plus lookahead
+    """
+    pages = scatter(_shard_page, stmt, key, limit, after, include_students)
+    items = merge(pages, itemgetter(key.key),
+                  None if limit is None else limit + 1)
+    return split_page(items, limit)
+
+def _encode_schools(school_ids, cache):
+    """Encode whole schools, caching each fragment under its version"""
+    columns = [getattr(School, name) for name in SCHOOL_FIELDS]
+    stmt = select(School.version, *columns).where(School.id.in_(school_ids))
+    schools = embed_students(serialize_rows(db.session.execute(stmt).all()))
+    fragments = {}
+    for school in schools:
+        version = school.pop("version")
+        fragments[school["id"]] = dumps(school)
+        cache.put(school["id"], version, fragments[school["id"]])
+    return fragments
+
+def _school_fragments(limit, after):
+    cache = current_app.extensions["school_fragments"]
+    stmt = paginate(select(School.id, School.version), School.id, limit,
+                    after)
+    rows = db.session.execute(stmt).all()
+    fragments = {row.id: cache.get(row.id, row.version) for row in rows}
+    stale = [school_id for school_id, hit in fragments.items() if hit is None]
+    if stale:
+        fragments.update(_encode_schools(stale, cache))
+    # A school deleted since the first query has no fragment to send
+    return [(row.id, fragments[row.id]) for row in rows
+            if fragments[row.id] is not None]
+
+def school_fragments(limit, after):
+    """
+    One keyset page of whole schools as (id, encoded JSON) pairs, and
+    whether more follow. Only ids and versions are read for every school,
+    the rest just for those whose cached fragment is missing or stale
+    """
+    pages = scatter(_school_fragments, limit, after)
+    items = merge(pages, itemgetter(0), None if limit is None else limit + 1)
+    return split_page(items, limit)
+
+def _has_school_name(name):
+    stmt = select(School.id).where(School.name == name)
+    return db.session.execute(stmt).first() is not None
+
+def _has_student(student_id):
+    stmt = select(Student.id).where(Student.id == student_id)
+    return db.session.execute(stmt).first() is not None
+
+def find_student(student_id):
+    """
+    Shard holding a student, None when none has it. Without sharding it is
+    always shard 0, leaving the caller's own query to find out
+    """
+    if shard_count() == 1:
+        return 0
+    found = scatter(_has_student, student_id)
+    return next((shard for shard, hit in enumerate(found) if hit), None)
+
+def create_claimed(resource, key, taken, create):
+    """
+    Call create() with key claimed across shards, returning its (body,
+    status), or taken when another write holds the key. The claim is kept
+    only if create() returns 201
+    """
+    if not claim_keys(resource, [key]):
+        return taken
+    created = False
+    try:
+        body, status = create()
+        created = status == 201
+    finally:
+        if not created:
+            release_keys(resource, [key])
+    return body, status
+
+def record_response(etag, record):
+    """A single record with its ETag, or 304 if the client has it"""
+    if is_fresh(etag):
+        return not_modified(etag)
+    response = json_response(record)
+    response.set_etag(etag)
+    return response, 200
+
 @api_blueprint.route('/schools', methods=['POST'])
 def create_school():
     """Create a new school"""
@@ -15,50 +192,132 @@ def create_school():
 
     if not data or not all(field in data for field in required_fields):
         return jsonify({"error": "Name and capacity are required"}), 400
+    if type(data["capacity"]) is not int:
+        return jsonify({"error": "Invalid capacity"}), 400
 
-    new_school = School(
-        name=data['name'],
-        capacity=data['capacity']
-    )
-    
-    try:
-        db.session.add(new_school)
-        db.session.commit()
-        school = serialize_school(new_school, include_students=False)
-        return jsonify(school), 201
-    except IntegrityError:
-        db.session.rollback()
-        return jsonify({"error": "School name must be unique"}), 400
+    taken = {"error": "School name must be unique"}, 400
+
+    def create():
+        # Names given before claims were taken are only found on the shards
+        if shard_count() > 1 and any(scatter(_has_school_name,
+                                             data["name"])):
+            return taken
+        return perform(add_school, data, "schools", shard=place_school())
+
+    school, status = create_claimed("schools", data["name"], taken, create)
+    return jsonify(school), status
 
 @api_blueprint.route('/schools/<int:school_id>', methods=['DELETE'])
 def delete_school(school_id):
-    """Delete a school given its ID"""
-    school = db.session.get(School, school_id)
-    if not school:
-        return jsonify({"error": "School not found"}), 404
-        
-    db.session.delete(school)
-    db.session.commit()
-    return jsonify({"message": "School deleted successfully"}), 200
+    """Delete a school given its ID, along with its students"""
+    with on_shard(shard_of(school_id)):
+        bump_revisions("schools", "students")
+        # Set-based, so the cost does not grow with loading every student
+        options = {"synchronize_session": False}
+        # Logged with INSERT ... SELECT so the students never reach Python
+        db.session.execute(insert(Change).from_select(
+                ["resource", "action", "resource_id", "school_id"],
+                select(literal("students"), literal("deleted"),
+                       Student.id, Student.school_id)
+                .where(Student.school_id == school_id)))
+        students = delete(Student).where(Student.school_id == school_id)
+        student_ids = []
+        if shard_count() > 1:
+            # Their IDs are needed to release their claims
+            student_ids = db.session.execute(
+                    students.returning(Student.id),
+                    execution_options=options).scalars().all()
+        else:
+            db.session.execute(students, execution_options=options)
+        name = db.session.execute(
+                delete(School).where(School.id == school_id)
+                .returning(School.name),
+                execution_options=options).scalar()
+        if name is None:
+            db.session.rollback()
+            return jsonify({"error": "School not found"}), 404
+
+        record_changes("schools", "deleted", [(school_id, school_id)])
+
+        db.session.commit()
+        release_keys("students", student_ids)
+        release_keys("schools", [name])
+        # Its fragment could no longer be served, only its memory is freed
+        cache = current_app.extensions.get("school_fragments")
+        if cache is not None:
+            cache.discard(school_id)
+        return jsonify({"message": "School deleted successfully"}), 200
 
 @api_blueprint.route('/schools', methods=['GET'])
 def get_schools():
-    """Retrieve all schools with their students"""
-    stmt = select(School)
-    schools = db.session.execute(stmt).scalars().all()
-    
-    schools = [serialize_school(s) for s in schools]
-    return jsonify(schools), 200
+    """Retrieve all schools with their students, optionally paginated"""
+    try:
+        limit, after = parse_page_args(request.args, int)
+    except ValueError:
+        return jsonify({"error": "Invalid pagination parameters"}), 400
+    try:
+        fields, include_students = parse_school_shape(request.args)
+    except ValueError:
+        return jsonify({"error": "Invalid fields or include"}), 400
+
+    # Read before the data so a concurrent write can only make it look stale
+    etag = f"schools-{revision_tag('schools')}"
+    if is_fresh(etag):
+        return not_modified(etag)
+
+    if ("school_fragments" in current_app.extensions
+            and include_students and fields == SCHOOL_FIELDS):
+        fragments, has_more = school_fragments(limit, after)
+        next_cursor = fragments[-1][0] if has_more else None
+        response = fragments_response(
+                [fragment for _, fragment in fragments], next_cursor)
+    else:
+        columns = [getattr(School, name) for name in fields]
+        schools, has_more = sharded_page(select(*columns), School.id, limit,
+                                         after, include_students)
+        next_cursor = schools[-1]["id"] if has_more else None
+        response = page_response(schools, next_cursor)
+    response.set_etag(etag)
+    return response, 200
 
 @api_blueprint.route('/schools/<int:school_id>', methods=['GET'])
 def get_school_by_id(school_id):
     """Retrieve a specific school and its students"""
-    school = db.session.get(School, school_id)
-    if not school:
-        return jsonify({"error": "School not found"}), 404
-        
-    school = serialize_school(school)
-    return jsonify(school), 200
+    try:
+        fields, include_students = parse_school_shape(request.args)
+    except ValueError:
+        return jsonify({"error": "Invalid fields or include"}), 400
+
+    cache = record_cache()
+    key = ("school", school_id, fields, include_students)
+    cached = cache.get(key) if cache is not None else None
+    if cached is not None:
+        return record_response(*cached)
+
+    shard = shard_of(school_id)
+    with on_shard(shard):
+        stamp = cache.stamp(shard) if cache is not None else None
+        if request.if_none_match:
+            stmt = select(School.version).where(School.id == school_id)
+            version = db.session.execute(stmt).scalar()
+            if version is None:
+                return jsonify({"error": "School not found"}), 404
+            if is_fresh(f"school-{school_id}-{version}"):
+                return not_modified(f"school-{school_id}-{version}")
+
+        columns = [getattr(School, name) for name in fields]
+        stmt = select(School.version, *columns).where(School.id == school_id)
+        row = db.session.execute(stmt).first()
+        if not row:
+            return jsonify({"error": "School not found"}), 404
+
+        school = dict(zip(fields, row[1:]))
+        if include_students:
+            embed_students([school])
+    etag = f"school-{school_id}-{row.version}"
+    if cache is not None:
+        cache.put(key, shard, stamp, (etag, school))
+    return record_response(etag, school)
 
 @api_blueprint.route('/schools/search', methods=['GET'])
 def search_schools():
@@ -66,13 +325,24 @@ def search_schools():
     query = request.args.get('query', '')
     if not query:
         return jsonify({"error": "Query parameter required"}), 400
-        
-    stmt = select(School).where(School.name.ilike(f"%{query}%"))
-    results = db.session.execute(stmt).scalars().all()
-    
-    schools = [serialize_school(s, include_students=False) for s in results]
+
+    try:
+        limit = parse_limit(request.args,
+                            current_app.config["SEARCH_RESULT_LIMIT"])
+    except ValueError:
+        return jsonify({"error": "Invalid limit"}), 400
+
+    rank = search_rank(school_search, query).label("rank")
+    stmt = search_schools_stmt(query, limit).add_columns(rank)
+    results = merge(scatter(_search_schools, stmt), itemgetter(0, 1), limit)
+
+    schools = [school for _, _, school in results]
     return jsonify(schools), 200
 
+def _search_schools(stmt):
+    return [(rank, school.id, serialize_school(school, include_students=False))
+            for school, rank in db.session.execute(stmt)]
+
 @api_blueprint.route('/students', methods=['POST'])
 def create_student():
     """Create a new student"""
@@ -81,59 +351,162 @@ def create_student():
     required_fields = ['id', 'first_name', 'last_name', 'school_id']
     if not all(field in data for field in required_fields):
         return jsonify({"error": "Missing required fields"}), 400
+    if type(data['school_id']) is not int:
+        return jsonify({"error": "Invalid school_id"}), 400
 
-    school = db.session.get(School, data['school_id'])
-    if not school:
-        return jsonify({"error": "School not found"}), 404
-        
-    if len(school.students) >= school.capacity:
-        return jsonify({"error": "School is at maximum capacity"}), 403
-
-    new_student = Student(
-        id=data['id'],
-        first_name=data['first_name'],
-        last_name=data['last_name'],
-        school_id=data['school_id']
-    )
-    
-    try:
-        db.session.add(new_student)
-        db.session.commit()
-        student = serialize_student(new_student)
-        return jsonify(student), 201
-    except IntegrityError:
-        db.session.rollback()
-        return jsonify({"error": "Student ID already exists"}), 409
+    taken = {"error": "Student ID already exists"}, 409
+
+    def create():
+        # IDs given before claims were taken are only found on the shards
+        if shard_count() > 1 and find_student(data['id']) is not None:
+            return taken
+        return perform(add_student, data, "schools", "students",
+                       shard=shard_of(data['school_id']))
+
+    student, status = create_claimed("students", data['id'], taken, create)
+    return jsonify(student), status
+
+@api_blueprint.route('/students/bulk', methods=['POST'])
+def create_students_bulk():
+    """Create many students from a JSON array or an NDJSON stream"""
+    if request.mimetype == 'application/x-ndjson':
+        rows = read_ndjson(request.stream)
+    else:
+        rows = request.get_json(silent=True)
+        if not isinstance(rows, list):
+            return jsonify({"error": "Expected a JSON array of students"}), 400
+
+    results = import_students(rows, current_app.config["BULK_CHUNK_SIZE"])
+    created = sum(1 for result in results if result["status"] == 201)
+    return jsonify({
+        "created": created,
+        "failed": len(results) - created,
+        "results": results,
+        }), 200
 
 @api_blueprint.route('/students/<string:student_id>', methods=['DELETE'])
 def delete_student(student_id):
     """Delete a student given its ID"""
-    student = db.session.get(Student, student_id)
-    if not student:
+    shard = find_student(student_id)
+    if shard is None:
         return jsonify({"error": "Student not found"}), 404
-        
-    db.session.delete(student)
-    db.session.commit()
+
+    with on_shard(shard):
+        student = db.session.get(Student, student_id)
+        if not student:
+            return jsonify({"error": "Student not found"}), 404
+
+        bump_revisions("schools", "students")
+        release_seats(student.school_id)
+        record_changes("students", "deleted",
+                       [(student.id, student.school_id)])
+        db.session.delete(student)
+        db.session.commit()
+    release_keys("students", [student_id])
     return jsonify({"message": "Student deleted successfully"}), 200
 
+@api_blueprint.route('/students', methods=['DELETE'])
+def delete_students_bulk():
+    """Delete every student in a list of IDs"""
+    try:
+        ids = parse_id_list(request.get_json(silent=True))
+    except ValueError:
+        return jsonify({"error": "Expected a list of student IDs"}), 400
+
+    missing = delete_students(ids, current_app.config["BULK_CHUNK_SIZE"])
+    return jsonify({
+        "deleted": len(set(ids)) - len(missing),
+        "missing": missing,
+        }), 200
+
+@api_blueprint.route('/students/transfer', methods=['POST'])
+def transfer_students():
+    """Move a list of students, or all of a school's, to another school"""
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict) or ("ids" in data) == ("from_school_id"
+                                                         in data):
+        return jsonify({"error": "Expected school_id and either ids or "
+                                 "from_school_id"}), 400
+    school_ids = [data.get("school_id"), data.get("from_school_id", 0)]
+    if not all(type(value) is int for value in school_ids):
+        return jsonify({"error": "Invalid school_id"}), 400
+    try:
+        ids = parse_id_list(data) if "ids" in data else None
+    except ValueError:
+        return jsonify({"error": "Expected a list of student IDs"}), 400
+
+    try:
+        moved = move_students(data["school_id"],
+                              current_app.config["BULK_CHUNK_SIZE"],
+                              ids=ids,
+                              from_school_id=data.get("from_school_id"))
+    except Rejected as error:
+        body = {"error": error.message, **error.details}
+        return jsonify(body), error.status
+    return jsonify({"moved": moved, "school_id": data["school_id"]}), 200
+
 @api_blueprint.route('/students', methods=['GET'])
 def get_students():
-    """Retrieve all students"""
-    stmt = select(Student)
-    raw_students = db.session.execute(stmt).scalars().all()
+    """Retrieve all students, optionally paginated"""
+    try:
+        limit, after = parse_page_args(request.args, str)
+    except ValueError:
+        return jsonify({"error": "Invalid pagination parameters"}), 400
 
-    students = [serialize_student(s) for s in raw_students]
-    return jsonify(students), 200
+    students, has_more = sharded_page(select(*STUDENT_COLUMNS), Student.id,
+                                      limit, after)
+    next_cursor = students[-1]["id"] if has_more else None
+    return page_response(students, next_cursor), 200
+
+@api_blueprint.route('/students/lookup', methods=['POST'])
+def lookup_students():
+    """Retrieve many students by ID in one query"""
+    try:
+        ids = parse_id_list(request.get_json(silent=True))
+    except ValueError:
+        return jsonify({"error": "Expected a list of student IDs"}), 400
+    ids = list(dict.fromkeys(ids))
+    if len(ids) > current_app.config["LOOKUP_MAX_IDS"]:
+        return jsonify({"error": "Too many student IDs"}), 400
+
+    found = {row["id"]: row
+             for rows in scatter(_lookup_students, ids) for row in rows}
+    return json_response({
+        "students": [found[i] for i in ids if i in found],
+        "missing": [i for i in ids if i not in found],
+        }), 200
+
+def _lookup_students(ids):
+    stmt = select(*STUDENT_COLUMNS).where(Student.id.in_(ids))
+    return serialize_rows(db.session.execute(stmt).all())
 
 @api_blueprint.route('/students/<string:student_id>', methods=['GET'])
 def get_student_by_id(student_id):
     """Retrieve a student given its ID"""
-    student = db.session.get(Student, student_id)
+    cache = record_cache()
+    key = ("student", student_id)
+    cached = cache.get(key) if cache is not None else None
+    if cached is not None:
+        return record_response(*cached)
+
+    shard = find_student(student_id)
+    if shard is None:
+        return jsonify({"error": "Student not found"}), 404
+    with on_shard(shard):
+        stamp = cache.stamp(shard) if cache is not None else None
+    etag = f"students-{revision_tag('students')}"
+    if is_fresh(etag):
+        return not_modified(etag)
+
+    with on_shard(shard):
+        student = db.session.get(Student, student_id)
     if not student:
         return jsonify({"error": "Student not found"}), 404
-        
+
     student = serialize_student(student)
-    return jsonify(student), 200
+    if cache is not None:
+        cache.put(key, shard, stamp, (etag, student))
+    return record_response(etag, student)
 
 @api_blueprint.route('/students/search', methods=['GET'])
 def search_students():
@@ -142,13 +515,108 @@ def search_students():
     if not query:
         return jsonify({"error": "Query parameter required"}), 400
 
-    stmt = select(Student).where(
-        or_(
-            Student.first_name.ilike(f"%{query}%"),
-            Student.last_name.ilike(f"%{query}%")
-        )
-    )
-    raw_students = db.session.execute(stmt).scalars().all()
-    
-    students = [serialize_student(s) for s in raw_students]
-    return jsonify(students), 200
+    try:
+        limit = parse_limit(request.args,
+                            current_app.config["SEARCH_RESULT_LIMIT"])
+    except ValueError:
+        return jsonify({"error": "Invalid limit"}), 400
+
+    rank = search_rank(student_search, query).label("rank")
+    stmt = search_students_stmt(query, limit, *STUDENT_COLUMNS)
+    results = merge(scatter(_search_students, stmt.add_columns(rank)),
+                    itemgetter(0, 1), limit)
+    return json_response([student for _, _, student in results]), 200
+
+def _search_students(stmt):
+    results = []
+    for row in db.session.execute(stmt):
+        student = row._asdict()
+        results.append((student.pop("rank"), student["id"], student))
+    return results
+
+@api_blueprint.route('/export/schools', methods=['GET'])
+def export_schools():
+    """Stream every school as NDJSON or CSV"""
+    columns = [getattr(School, name) for name in SCHOOL_FIELDS]
+    try:
+        return export_response(select(*columns).order_by(School.id),
+                               "schools")
+    except ValueError:
+        return jsonify({"error": "Format must be ndjson or csv"}), 400
+
+@api_blueprint.route('/export/students', methods=['GET'])
+def export_students():
+    """Stream every student as NDJSON or CSV"""
+    try:
+        return export_response(select(*STUDENT_COLUMNS).order_by(Student.id),
+                               "students")
+    except ValueError:
+        return jsonify({"error": "Format must be ndjson or csv"}), 400
+
+@api_blueprint.route('/stats/occupancy', methods=['GET'])
+def get_occupancy():
+    """Occupancy per school and overall, from the stored student counts"""
+    try:
+        limit, after = parse_page_args(request.args, int)
+    except ValueError:
+        return jsonify({"error": "Invalid pagination parameters"}), 400
+
+    # Every enrolment change bumps the schools revision too
+    etag = f"occupancy-{revision_tag('schools')}"
+    if is_fresh(etag):
+        return not_modified(etag)
+
+    stmt = select(
+            School.id,
+            School.name,
+            School.capacity,
+            School.student_count,
+            utilization.label("utilization"),
+            )
+    schools, has_more = sharded_page(stmt, School.id, limit, after)
+
+    response = page_response({
+        "totals": occupancy_totals(),
+        "histogram": utilization_histogram(
+            current_app.config["OCCUPANCY_BUCKETS"]),
+        "schools": schools,
+        }, schools[-1]["id"] if has_more else None)
+    response.set_etag(etag)
+    return response, 200
+
+@api_blueprint.route('/changes', methods=['GET'])
+def get_changes():
+    """Retrieve the creations and deletions logged after a cursor"""
+    try:
+        since = parse_cursor(request.args.get('since', 0))
+        limit = parse_limit(request.args,
+                            current_app.config["CHANGES_PAGE_SIZE"])
+    except ValueError:
+        return jsonify({"error": "Invalid since or limit"}), 400
+    if expired(since):
+        return jsonify({"error": "Cursor is older than the retained "
+                                 "changes"}), 410
+
+    changes, positions = changes_since(since, limit)
+    return json_response({
+        "changes": changes,
+        "cursor": format_cursor(positions),
+        }), 200
+
+@api_blueprint.route('/changes/stream', methods=['GET'])
+def stream_changes():
+    """Push logged changes as Server-Sent Events"""
+    since = request.args.get('since', request.headers.get('Last-Event-ID'))
+    max_timeout = current_app.config["CHANGES_STREAM_TIMEOUT"]
+    try:
+        since = latest_cursor() if since is None else parse_cursor(since)
+        timeout = float(request.args.get('timeout', max_timeout))
+    except ValueError:
+        return jsonify({"error": "Invalid since or timeout"}), 400
+    if not 0 <= timeout <= max_timeout:
+        return jsonify({"error": "Invalid since or timeout"}), 400
+    if expired(since):
+        return jsonify({"error": "Cursor is older than the retained "
+                                 "changes"}), 410
+
+    return event_stream(since, timeout)
@@ -0,0 +1,73 @@
+from sqlalchemy import func, select
+from sqlalchemy.exc import IntegrityError
+from ..models.models import db, School, Student, take_seats, record_changes
+from ..models.sharding import shard_count, current_shard
+from .helpers import serialize_school, serialize_student
+
+
+class Rejected(Exception):
+    """A write refused with an HTTP status and error message"""
+
+    def __init__(self, status, message, **details):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+        # Extra fields for the error response body
+        self.details = details
+
+
+# Each write runs inside a transaction it does not commit, after the
+# caller has bumped the revisions it lists, and returns the created
+# resource serialized. Raising Rejected means its changes must be undone.
+
+def _next_school_id():
+    """
+    Smallest free id above the others that maps to the current shard, or
+    None to let the database assign one when there is a single shard. The
+    caller's revision bump already holds the shard's write lock
+    """
+    shards = shard_count()
+    if shards == 1:
+        return None
+    last = db.session.execute(select(func.max(School.id))).scalar() or 0
+    return last + 1 + (current_shard() - last - 1) % shards
+
+
+def add_school(data, revisions):
+    """Insert a school, versioned with the bumped schools revision"""
+    school = School(
+        id=_next_school_id(),
+        name=data['name'],
+        capacity=data['capacity'],
+        version=revisions["schools"],
+    )
+    db.session.add(school)
+    try:
+        db.session.flush()
+    except IntegrityError:
+        raise Rejected(400, "School name must be unique")
+    record_changes("schools", "created", [(school.id, school.id)])
+    return serialize_school(school, include_students=False)
+
+
+def add_student(data, revisions):
+    """Insert a student, claiming a seat in its school"""
+    if not take_seats(data['school_id']):
+        if not db.session.get(School, data['school_id']):
+            raise Rejected(404, "School not found")
+        raise Rejected(403, "School is at maximum capacity")
+
+    student = Student(
+        id=data['id'],
+        first_name=data['first_name'],
+        last_name=data['last_name'],
+        school_id=data['school_id']
+    )
+    db.session.add(student)
+    try:
+        db.session.flush()
+    except IntegrityError:
+        raise Rejected(409, "Student ID already exists")
+    record_changes("students", "created", [(student.id, student.school_id)])
+    return serialize_student(student)
+
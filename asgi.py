@@ -0,0 +1,7 @@
+import os
+from app import create_asgi_app
+from dotenv import load_dotenv
+
+load_dotenv()
+env = os.getenv('FLASK_ENV')
+app = create_asgi_app(env)
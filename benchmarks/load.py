@@ -0,0 +1,372 @@
+"""
+Seed a dataset, drive every API route at fixed concurrency and report
+throughput, latency percentiles and SQL statements per endpoint as JSON.
+
+    python -m benchmarks.load --schools 10000 --students 1000000 \
+        --concurrency 16 --requests 500 --output bench.json
+
+The API runs in-process on a threaded WSGI server against a scratch
+database, so results from different commits are comparable as long as the
+arguments match.
+"""
+import argparse
+import itertools
+import json
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from urllib.parse import quote
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import g, request
+from sqlalchemy import event, func, insert, select, update
+from werkzeug.serving import WSGIRequestHandler, make_server
+
+FIRST_NAMES = ["Jordi", "Maria", "Pau", "Laia", "Marc", "Anna", "Joan",
+               "Marta", "Pere", "Núria", "Arnau", "Clara"]
+LAST_NAMES = ["Pujol", "Vila", "Casals", "Roca", "Mas", "Soler", "Puig",
+              "Ferrer", "Font", "Serra", "Vidal", "Camps"]
+
+
+class QuietHandler(WSGIRequestHandler):
+    """Request handler that skips the per-request access log line"""
+
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+class Dataset:
+    """Identifiers of the seeded rows, shared by the request generators"""
+
+    def __init__(self, schools, students, seed):
+        self.schools = schools
+        self.students = students
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.sequence = itertools.count()
+        self.doomed = itertools.count(schools, -1)
+        # Seeded students not yet deleted by the DELETE scenario
+        self.deletable = list(range(students))
+        self.rng.shuffle(self.deletable)
+
+    def school_id(self):
+        with self.lock:
+            return self.rng.randint(1, self.schools)
+
+    def student_id(self):
+        with self.lock:
+            return student_key(self.rng.randrange(self.students))
+
+    def name(self):
+        with self.lock:
+            return self.rng.choice(FIRST_NAMES + LAST_NAMES)
+
+    def unique(self):
+        return next(self.sequence)
+
+    def pop_school(self):
+        return next(self.doomed)
+
+    def enrolled(self, n):
+        """n seeded students not deleted, left in place for later scenarios"""
+        with self.lock:
+            picked = self.rng.sample(self.deletable,
+                                     min(n, len(self.deletable)))
+        return [student_key(i) for i in picked]
+
+    def pop_student(self):
+        with self.lock:
+            if self.deletable:
+                return student_key(self.deletable.pop())
+        return student_key(self.students + self.unique())
+
+
+def student_key(n):
+    return f"B{n:08d}"
+
+
+def new_student(data):
+    return {
+        "id": f"N{data.unique():08d}",
+        "first_name": "Bench",
+        "last_name": "Mark",
+        "school_id": data.school_id(),
+    }
+
+
+# One request generator per blueprint endpoint: method, then a function
+# building the path and JSON body
+SCENARIOS = {
+    "api.get_schools": ("GET", lambda d: ("/schools?limit=100", None)),
+    "api.get_school_by_id": ("GET", lambda d: (
+        f"/schools/{d.school_id()}", None)),
+    "api.search_schools": ("GET", lambda d: (
+        f"/schools/search?query={d.rng.randint(0, d.schools)}", None)),
+    "api.get_students": ("GET", lambda d: ("/students?limit=100", None)),
+    "api.get_student_by_id": ("GET", lambda d: (
+        f"/students/{d.student_id()}", None)),
+    "api.lookup_students": ("POST", lambda d: (
+        "/students/lookup", {"ids": [d.student_id() for _ in range(100)]})),
+    "api.search_students": ("GET", lambda d: (
+        f"/students/search?query={d.name()}", None)),
+    "api.get_occupancy": ("GET", lambda d: (
+        "/stats/occupancy?limit=100", None)),
+    "api.get_changes": ("GET", lambda d: ("/changes?limit=100", None)),
+    "api.stream_changes": ("GET", lambda d: (
+        "/changes/stream?since=0&timeout=0", None)),
+    "api.export_schools": ("GET", lambda d: ("/export/schools", None)),
+    "api.export_students": ("GET", lambda d: ("/export/students", None)),
+    "api.create_school": ("POST", lambda d: (
+        "/schools", {"name": f"Bench school {d.unique()}", "capacity": 100})),
+    "api.create_student": ("POST", lambda d: ("/students", new_student(d))),
+    "api.create_students_bulk": ("POST", lambda d: (
+        "/students/bulk", [new_student(d) for _ in range(100)])),
+    "api.delete_student": ("DELETE", lambda d: (
+        f"/students/{d.pop_student()}", None)),
+    "api.delete_students_bulk": ("DELETE", lambda d: (
+        "/students", {"ids": [d.pop_student() for _ in range(100)]})),
+    "api.transfer_students": ("POST", lambda d: (
+        "/students/transfer",
+        {"ids": d.enrolled(100), "school_id": d.school_id()})),
+    "api.delete_school": ("DELETE", lambda d: (
+        f"/schools/{d.pop_school()}", None)),
+}
+
+# Writes run after the reads so they do not skew them, and dropping whole
+# schools comes last of all
+RUN_LAST = ("api.delete_school",)
+
+
+def run_order(name):
+    method, _ = SCENARIOS[name]
+    return method != "GET", name in RUN_LAST, name
+
+
+def seed(schools, students, chunk=10000):
+    """Insert schools and evenly spread students with Core executemany"""
+    from app import db
+    from app.models.models import School, Student
+
+    per_school = -(-students // schools) if schools else 0
+    db.session.execute(insert(School), [
+        {
+            "id": i,
+            "name": f"Escola {i:07d}",
+            "capacity": per_school * 2 + 100,
+        }
+        for i in range(1, schools + 1)
+    ])
+    for start in range(0, students, chunk):
+        rows = [
+            {
+                "id": student_key(n),
+                "first_name": FIRST_NAMES[n % len(FIRST_NAMES)],
+                "last_name": LAST_NAMES[(n // 7) % len(LAST_NAMES)],
+                "school_id": n % schools + 1,
+            }
+            for n in range(start, min(start + chunk, students))
+        ]
+        db.session.execute(insert(Student), rows)
+    enrolled = (
+        select(func.count(Student.id))
+        .where(Student.school_id == School.id)
+        .scalar_subquery()
+    )
+    db.session.execute(update(School).values(student_count=enrolled))
+    db.session.commit()
+
+
+def instrument(app, db):
+    """Count SQL statements per request, keyed by endpoint"""
+    counts = defaultdict(list)
+    lock = threading.Lock()
+
+    def before_cursor_execute(*args):
+        if "bench_queries" in g:
+            g.bench_queries += 1
+
+    @app.before_request
+    def start_counting():
+        g.bench_queries = 0
+
+    @app.after_request
+    def stop_counting(response):
+        with lock:
+            counts[request.endpoint].append(g.pop("bench_queries", 0))
+        return response
+
+    with app.app_context():
+        event.listen(db.engine, "before_cursor_execute",
+                     before_cursor_execute)
+    return counts
+
+
+def send(base_url, method, path, body):
+    data = None
+    headers = {}
+    if body is not None:
+        data = json.dumps(body).encode()
+        headers["Content-Type"] = "application/json"
+    outgoing = urllib.request.Request(base_url + quote(path, safe="/?=&"),
+                                      data=data, headers=headers,
+                                      method=method)
+    started = time.perf_counter()
+    try:
+        with urllib.request.urlopen(outgoing) as response:
+            response.read()
+            status = response.status
+    except urllib.error.HTTPError as error:
+        error.read()
+        status = error.code
+    return status, time.perf_counter() - started
+
+
+def percentile(ordered, fraction):
+    if not ordered:
+        return None
+    index = min(len(ordered) - 1, max(0, round(fraction * len(ordered)) - 1))
+    return ordered[index]
+
+
+def drive(base_url, scenario, data, requests, concurrency):
+    """Fire requests at fixed concurrency, returning latencies and statuses"""
+    method, build = scenario
+
+    def one(_):
+        return send(base_url, method, *build(data))
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(one, range(requests)))
+    elapsed = time.perf_counter() - started
+
+    latencies = sorted(latency for _, latency in results)
+    statuses = Counter(status for status, _ in results)
+    return {
+        "requests": requests,
+        "errors": sum(n for code, n in statuses.items() if code >= 500),
+        "status": {str(code): n for code, n in sorted(statuses.items())},
+        "throughput_rps": round(requests / elapsed, 2),
+        "latency_ms": {
+            "mean": round(statistics.fmean(latencies) * 1000, 3),
+            "p50": round(percentile(latencies, 0.50) * 1000, 3),
+            "p95": round(percentile(latencies, 0.95) * 1000, 3),
+            "p99": round(percentile(latencies, 0.99) * 1000, 3),
+            "max": round(latencies[-1] * 1000, 3),
+        },
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def run(app, data, requests, concurrency, endpoints=None):
+    """Benchmark every blueprint route of an already seeded app"""
+    from app import db
+
+    counts = instrument(app, db)
+    rules = sorted({rule.endpoint for rule in app.url_map.iter_rules()
+                    if rule.endpoint.startswith("api.")})
+    missing = [name for name in rules if name not in SCENARIOS]
+    if missing:
+        raise SystemExit(f"No benchmark scenario for: {', '.join(missing)}")
+    if endpoints:
+        rules = [name for name in rules if name in endpoints]
+    rules.sort(key=run_order)
+
+    server = make_server("127.0.0.1", 0, app, threaded=True,
+                         request_handler=QuietHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    base_url = f"http://127.0.0.1:{server.server_port}"
+
+    report = {}
+    try:
+        for name in rules:
+            result = drive(base_url, SCENARIOS[name], data, requests,
+                           concurrency)
+            queries = counts.pop(name, []) or [0]
+            result["queries"] = {
+                "mean": round(statistics.fmean(queries), 2),
+                "max": max(queries),
+            }
+            report[name] = result
+    finally:
+        server.shutdown()
+        thread.join()
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--schools", type=int, default=1000)
+    parser.add_argument("--students", type=int, default=50000)
+    parser.add_argument("--requests", type=int, default=200,
+                        help="requests per endpoint")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--endpoint", action="append", dest="endpoints",
+                        help="only benchmark this endpoint (repeatable)")
+    parser.add_argument("--database", help="SQLite file to seed, "
+                        "defaults to a temporary one")
+    parser.add_argument("--output", help="write the JSON report here")
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.TemporaryDirectory()
+    path = args.database or os.path.join(workdir.name, "bench.db")
+    if os.path.exists(path):
+        raise SystemExit(f"{path} already exists")
+    # Config reads the database URL at import time
+    os.environ["DATABASE_URL"] = f"sqlite:///{path}"
+    from app import create_app
+
+    app = create_app("production")
+    started = time.perf_counter()
+    with app.app_context():
+        seed(args.schools, args.students)
+    seeded = time.perf_counter() - started
+
+    data = Dataset(args.schools, args.students, args.seed)
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "schools": args.schools,
+            "students": args.students,
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "seed_seconds": round(seeded, 2),
+        },
+        "endpoints": run(app, data, args.requests, args.concurrency,
+                         args.endpoints),
+    }
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as handle:
+            handle.write(output + "\n")
+    else:
+        sys.stdout.write(output + "\n")
+    workdir.cleanup()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""
+Compare serializing a student listing through ORM objects against the
+column projection used by the list endpoints.
+
+    python -m benchmarks.serialization --students 100000 --repeat 5
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+from flask import jsonify
+from sqlalchemy import select
+
+from .load import seed
+
+
+def best_of(repeat, func):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+def compare(students, repeat):
+    """Seconds per full listing for each path, on the current app context"""
+    from app import db
+    from app.models.models import Student
+    from app.routes.helpers import dumps, serialize_rows, serialize_student
+    from app.routes.routes import STUDENT_COLUMNS
+
+    def orm():
+        db.session.expunge_all()
+        rows = db.session.execute(select(Student)).scalars().all()
+        jsonify([serialize_student(s) for s in rows]).get_data()
+
+    def projection():
+        rows = db.session.execute(select(*STUDENT_COLUMNS)).all()
+        dumps(serialize_rows(rows))
+
+    results = {}
+    for name, func in (("orm", orm), ("projection", projection)):
+        seconds = best_of(repeat, func)
+        results[name] = {
+            "seconds": round(seconds, 4),
+            "rows_per_second": round(students / seconds),
+        }
+    results["speedup"] = round(
+        results["orm"]["seconds"] / results["projection"]["seconds"], 2)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--students", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        # Config reads the database URL at import time
+        path = os.path.join(workdir, "bench.db")
+        os.environ["DATABASE_URL"] = f"sqlite:///{path}"
+        from app import create_app
+
+        app = create_app("production")
+        with app.app_context():
+            seed(max(1, args.students // 100), args.students)
+            report = compare(args.students, args.repeat)
+    sys.stdout.write(json.dumps(report, indent=2) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,21 +3,114 @@ import os
 
 basedir = os.path.abspath(os.path.dirname(__file__))
 
+def engine_options():
+    """Connection pool settings given through the environment"""
+    variables = {
+        'pool_size': 'DB_POOL_SIZE',
+        'max_overflow': 'DB_MAX_OVERFLOW',
+        'pool_timeout': 'DB_POOL_TIMEOUT',
+        'pool_recycle': 'DB_POOL_RECYCLE',
+    }
+    return {
+        option: int(os.environ[variable])
+        for option, variable in variables.items()
+        if variable in os.environ
+    }
+
+def shard_binds():
+    """Extra shards listed in SHARD_DATABASE_URLS, bound as shard1..shardN"""
+    urls = os.getenv('SHARD_DATABASE_URLS', '').split(',')
+    urls = [url.strip() for url in urls if url.strip()]
+    return {f'shard{index}': url for index, url in enumerate(urls, start=1)}
+
 class Config:
     SECRET_KEY = os.getenv('SECRET_KEY', 'default-secret')
+    SQLALCHEMY_DATABASE_URI = os.getenv(
+            'DATABASE_URL',
+            'sqlite:///' + os.path.join(basedir, 'app.db'),
+            )
+    SQLALCHEMY_ENGINE_OPTIONS = engine_options()
+    # Schools and their students are split by school_id % N across
+    # DATABASE_URL and these, see app.models.sharding
+    SQLALCHEMY_BINDS = shard_binds()
+    # Used by create_asgi_app, derived from DATABASE_URL when unset
+    SQLALCHEMY_ASYNC_DATABASE_URI = os.getenv('ASYNC_DATABASE_URL')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # Applied to every new SQLite connection. WAL lets readers run alongside
+    # the single writer and busy_timeout makes writers wait instead of
+    # failing with "database is locked"
+    SQLITE_PRAGMAS = {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'busy_timeout': int(os.getenv('SQLITE_BUSY_TIMEOUT', 5000)),
+        'cache_size': int(os.getenv('SQLITE_CACHE_SIZE', -64000)),
+        'mmap_size': int(os.getenv('SQLITE_MMAP_SIZE', 268435456)),
+        'temp_store': 'MEMORY',
+    }
+    PAGE_SIZE_MAX = 1000
+    SEARCH_RESULT_LIMIT = 50
+    BULK_CHUNK_SIZE = 1000
+    LOOKUP_MAX_IDS = 1000
+    EXPORT_BATCH_SIZE = 1000
+    # Change feed: entries per page or SSE batch, and for SSE streams the
+    # seconds between polls, between keepalives and before closing
+    CHANGES_PAGE_SIZE = 1000
+    CHANGES_POLL_INTERVAL = float(os.getenv('CHANGES_POLL_INTERVAL', 1.0))
+    CHANGES_HEARTBEAT = 15.0
+    CHANGES_STREAM_TIMEOUT = float(os.getenv('CHANGES_STREAM_TIMEOUT', 30.0))
+    # Changes kept per shard by `flask prune-changes`, 0 keeps them all
+    CHANGES_RETENTION = int(os.getenv('CHANGES_RETENTION', 1000000))
+    # Memory for the encoded schools GET /schools is assembled from, 0 to
+    # encode every school on each request
+    SCHOOL_FRAGMENT_CACHE_BYTES = int(os.getenv('SCHOOL_FRAGMENT_CACHE_BYTES',
+                                                64 * 1024 * 1024))
+    # Single school and student lookups kept per worker, and for how many
+    # seconds at most. 0 turns the cache off
+    RECORD_CACHE_SIZE = int(os.getenv('RECORD_CACHE_SIZE', 10000))
+    RECORD_CACHE_TTL = float(os.getenv('RECORD_CACHE_TTL', 60.0))
+    # Upper bounds of the utilization histogram of /stats/occupancy
+    OCCUPANCY_BUCKETS = (0.25, 0.5, 0.75, 0.9, 1.0)
+    # Group commit for create_school and create_student: writes arriving
+    # within WRITE_BATCH_WINDOW seconds, up to WRITE_BATCH_SIZE of them,
+    # share one transaction
+    WRITE_BATCHING = os.getenv('WRITE_BATCHING', '0') == '1'
+    WRITE_BATCH_SIZE = int(os.getenv('WRITE_BATCH_SIZE', 64))
+    WRITE_BATCH_WINDOW = float(os.getenv('WRITE_BATCH_WINDOW', 0.002))
+    METRICS_ENABLED = os.getenv('METRICS_ENABLED', '0') == '1'
+    # Admission control, see app.admission: requests a second and burst
+    # allowed per client, concurrent requests per endpoint class and the
+    # seconds a request may queue for a slot before a 503. Limits are per
+    # worker process.
+    ADMISSION_CONTROL = os.getenv('ADMISSION_CONTROL', '0') == '1'
+    RATE_LIMIT = float(os.getenv('RATE_LIMIT', 100))
+    RATE_LIMIT_BURST = int(os.getenv('RATE_LIMIT_BURST', 200))
+    # Header naming the client behind a proxy, e.g. X-Forwarded-For
+    RATE_LIMIT_CLIENT_HEADER = os.getenv('RATE_LIMIT_CLIENT_HEADER')
+    CONCURRENCY_LIMITS = {
+        'read': int(os.getenv('CONCURRENCY_LIMIT_READ', 32)),
+        'listing': int(os.getenv('CONCURRENCY_LIMIT_LISTING', 4)),
+        'write': int(os.getenv('CONCURRENCY_LIMIT_WRITE', 8)),
+    }
+    ADMISSION_QUEUE_TIMEOUT = float(os.getenv('ADMISSION_QUEUE_TIMEOUT', 0.1))
+    # On-demand profiling, see app.profiling: requests sending PROFILE_TOKEN
+    # in PROFILE_HEADER and PROFILE_SAMPLE_RATE percent of the rest are
+    # profiled, keeping the last PROFILE_KEEP. Without PROFILE_TOKEN there
+    # is only sampling and the reports are not served
+    PROFILING_ENABLED = os.getenv('PROFILING_ENABLED', '0') == '1'
+    PROFILE_HEADER = 'X-Profile'
+    PROFILE_TOKEN = os.getenv('PROFILE_TOKEN')
+    PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', 0))
+    PROFILE_DIR = os.getenv('PROFILE_DIR', 'profiles')
+    PROFILE_KEEP = int(os.getenv('PROFILE_KEEP', 100))
 
 class DevelopmentConfig(Config):
     DEBUG = True
-    SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(basedir, 'app.db')
 
 class TestingConfig(Config):
     TESTING = True
-    SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(basedir, 'app.db')
 
 class ProductionConfig(Config):
     DEBUG = False
-    SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(basedir, 'app.db')
 
 config_map = {
     'development': ('development', DevelopmentConfig),
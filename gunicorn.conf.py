@@ -0,0 +1,7 @@
+import os
+
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:5000")
+workers = int(os.getenv("WEB_CONCURRENCY", 2 * os.cpu_count() + 1))
+threads = int(os.getenv("GUNICORN_THREADS", 1))
+# create_app() disposes the engine, so workers open their own connections
+preload_app = os.getenv("GUNICORN_PRELOAD", "1") == "1"
@@ -0,0 +1,35 @@
+"""store school student_count
+
+Revision ID: 8b4e0d6c21a5
+Revises: 3f1c2a9d8e47
+Create Date: 2026-10-18 11:40:07.902114
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8b4e0d6c21a5'
+down_revision = '3f1c2a9d8e47'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    columns = sa.inspect(op.get_bind()).get_columns('school')
+    if any(column['name'] == 'student_count' for column in columns):
+        return
+
+    with op.batch_alter_table('school', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('student_count', sa.Integer(), server_default='0', nullable=False))
+
+    op.execute(
+        "UPDATE school SET student_count = "
+        "(SELECT count(*) FROM student WHERE student.school_id = school.id)"
+    )
+
+
+def downgrade():
+    with op.batch_alter_table('school', schema=None) as batch_op:
+        batch_op.drop_column('student_count')
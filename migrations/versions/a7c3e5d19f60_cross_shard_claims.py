@@ -0,0 +1,31 @@
+"""claims of unique keys across shards
+
+Revision ID: a7c3e5d19f60
+Revises: e2f9a47c1b86
+Create Date: 2026-10-18 21:14:52.630418
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a7c3e5d19f60'
+down_revision = 'e2f9a47c1b86'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    if 'claim' in inspector.get_table_names():
+        return
+    op.create_table('claim',
+    sa.Column('resource', sa.String(length=20), nullable=False),
+    sa.Column('key', sa.String(length=100), nullable=False),
+    sa.PrimaryKeyConstraint('resource', 'key', name=op.f('pk_claim'))
+    )
+
+
+def downgrade():
+    op.drop_table('claim')
@@ -0,0 +1,42 @@
+"""revision counters for conditional GET
+
+Revision ID: c5a7f31e9b02
+Revises: 8b4e0d6c21a5
+Create Date: 2026-10-18 14:05:52.417330
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c5a7f31e9b02'
+down_revision = '8b4e0d6c21a5'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    if 'revision' not in inspector.get_table_names():
+        revision_table = op.create_table('revision',
+        sa.Column('name', sa.String(length=20), nullable=False),
+        sa.Column('value', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('name', name=op.f('pk_revision'))
+        )
+        op.bulk_insert(revision_table, [
+            {'name': 'schools', 'value': 0},
+            {'name': 'students', 'value': 0},
+        ])
+
+    columns = inspector.get_columns('school')
+    if not any(column['name'] == 'version' for column in columns):
+        with op.batch_alter_table('school', schema=None) as batch_op:
+            batch_op.add_column(sa.Column('version', sa.Integer(), server_default='0', nullable=False))
+
+
+def downgrade():
+    with op.batch_alter_table('school', schema=None) as batch_op:
+        batch_op.drop_column('version')
+
+    op.drop_table('revision')
@@ -0,0 +1,35 @@
+"""change log for the change feed
+
+Revision ID: d8b61e0f4a39
+Revises: c5a7f31e9b02
+Create Date: 2026-10-18 16:42:08.913204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd8b61e0f4a39'
+down_revision = 'c5a7f31e9b02'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    if 'change' in inspector.get_table_names():
+        return
+    op.create_table('change',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('resource', sa.String(length=20), nullable=False),
+    sa.Column('action', sa.String(length=10), nullable=False),
+    sa.Column('resource_id', sa.String(length=20), nullable=False),
+    sa.Column('school_id', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('id', name=op.f('pk_change')),
+    sqlite_autoincrement=True
+    )
+
+
+def downgrade():
+    op.drop_table('change')
@@ -0,0 +1,28 @@
+"""index students by school
+
+Revision ID: e2f9a47c1b86
+Revises: d8b61e0f4a39
+Create Date: 2026-10-18 18:05:31.402117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e2f9a47c1b86'
+down_revision = 'd8b61e0f4a39'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    indexes = {index['name'] for index in inspector.get_indexes('student')}
+    if 'ix_student_school_id' in indexes:
+        return
+    op.create_index('ix_student_school_id', 'student', ['school_id', 'id'])
+
+
+def downgrade():
+    op.drop_index('ix_student_school_id', table_name='student')
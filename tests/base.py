@@ -1,11 +1,33 @@
 import unittest
 import json
+from contextlib import contextmanager
+from sqlalchemy import event
 from app import create_app, db
 from app.models.models import School, Student
 from config import config_map
 
 OFF_NUMBER = 100
 
+@contextmanager
+def count_queries(app):
+    """Collect every SQL statement sent through the app's engines"""
+    statements = []
+    engines = list(db.engines.values())
+    if "async_engine" in app.extensions:
+        engines.append(app.extensions["async_engine"].sync_engine)
+
+    def before_cursor_execute(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    for engine in engines:
+        event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        for engine in engines:
+            event.remove(engine, "before_cursor_execute",
+                         before_cursor_execute)
+
 class BaseTest(unittest.TestCase):
     def setUp(self):
 
@@ -15,7 +37,11 @@ class BaseTest(unittest.TestCase):
         with self.app.app_context():
             db.create_all()
 
-            school1 = School(id=1, name="Escola Gracia", capacity=2)
+            school1 = School(id=1,
+                             name="Escola Gracia",
+                             capacity=2,
+                             student_count=2,
+                             )
             school2 = School(id=2, name="Escola Eixample", capacity=100)
             db.session.add_all([school1, school2])
             
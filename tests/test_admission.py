@@ -0,0 +1,68 @@
+import threading
+import unittest
+from unittest.mock import patch
+from config import Config
+from .base import BaseTest
+
+class TestAdmissionControl(BaseTest):
+
+    def setUp(self):
+        settings = (
+            ("ADMISSION_CONTROL", True),
+            ("RATE_LIMIT", 1.0),
+            ("RATE_LIMIT_BURST", 3),
+            ("RATE_LIMIT_CLIENT_HEADER", "X-Forwarded-For"),
+            ("CONCURRENCY_LIMITS", {"read": 1, "listing": 1, "write": 1}),
+            ("ADMISSION_QUEUE_TIMEOUT", 0.05),
+        )
+        for name, value in settings:
+            patcher = patch.object(Config, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        super().setUp()
+        self.gates = self.app.extensions["admission"].gates
+
+    def get(self, path, client="10.0.0.1"):
+        return self.client.get(path, headers={"X-Forwarded-For": client})
+
+    def test_rate_limit_per_client(self):
+        """Test that a client over its burst gets 429 with Retry-After"""
+        for _ in range(3):
+            self.assertEqual(self.get('/schools/1').status_code, 200)
+        response = self.get('/schools/1')
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response.headers["Retry-After"], "1")
+        self.assertEqual(self.get('/schools/1', "10.0.0.2").status_code, 200)
+
+    def test_busy_class_sheds_with_503(self):
+        """Test that a full endpoint class answers 503 after the budget"""
+        self.assertTrue(self.gates["listing"].enter(0))
+        response = self.get('/schools')
+        self.assertEqual(response.status_code, 503)
+        self.assertIn("Retry-After", response.headers)
+        # Other classes keep their own slots
+        self.assertEqual(self.get('/schools/1').status_code, 200)
+
+        self.gates["listing"].leave()
+        self.assertEqual(self.get('/schools').status_code, 200)
+        self.assertEqual(self.gates["listing"].active, 0)
+
+    def test_queued_request_gets_freed_slot(self):
+        """Test that a request waits for a slot freed within the budget"""
+        self.app.extensions["admission"].timeout = 1.0
+        self.assertTrue(self.gates["write"].enter(0))
+        threading.Timer(0.05, self.gates["write"].leave).start()
+        response = self.client.post('/schools', json={
+            "name": "Escola Nova", "capacity": 5})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.gates["write"].active, 0)
+
+    def test_streams_are_exempt(self):
+        """Test that change streams hold no slot while open"""
+        self.assertTrue(self.gates["listing"].enter(0))
+        response = self.get('/changes/stream?timeout=0')
+        self.assertEqual(response.status_code, 200)
+        self.gates["listing"].leave()
+
+if __name__ == '__main__':
+    unittest.main()
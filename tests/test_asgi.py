@@ -0,0 +1,155 @@
+import asyncio
+import contextvars
+import threading
+import unittest
+from werkzeug.test import EnvironBuilder
+from sqlalchemy import event
+from .base import db
+from . import (
+        test_batching,
+        test_changes,
+        test_school_api,
+        test_student_api,
+        )
+from config import config_map
+
+try:
+    import aiosqlite
+    import greenlet
+    from app import create_asgi_app
+except ImportError:
+    create_asgi_app = None
+
+
+class ASGIClient:
+    """
+    Drop-in for the Flask test client that sends each request through the
+    ASGI app, on an event loop running in its own thread so that requests
+    from several threads share it
+    """
+
+    def __init__(self, asgi):
+        self.asgi = asgi
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever,
+                                       daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self.run(self.asgi.aclose())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+    def run(self, coroutine):
+        # Like a real server, start from an empty context rather than the
+        # caller's, which may hold an app context pushed by the test
+        future = contextvars.Context().run(
+                asyncio.run_coroutine_threadsafe, coroutine, self.loop)
+        return future.result()
+
+    def open(self, path, method="GET", **kwargs):
+        environ = EnvironBuilder(path, method=method, **kwargs).get_environ()
+        headers = [(key[5:].replace("_", "-").lower().encode("latin1"),
+                    value.encode("latin1"))
+                   for key, value in environ.items()
+                   if key.startswith("HTTP_")]
+        if environ.get("CONTENT_TYPE"):
+            headers.append((b"content-type",
+                            environ["CONTENT_TYPE"].encode("latin1")))
+        scope = {
+            "type": "http",
+            "http_version": "1.1",
+            "method": method,
+            "scheme": "http",
+            "path": environ["PATH_INFO"],
+            "root_path": "",
+            "query_string": environ["QUERY_STRING"].encode("latin1"),
+            "headers": headers,
+            "client": ("127.0.0.1", 0),
+            "server": ("localhost", 80),
+        }
+        body = environ["wsgi.input"].read()
+        return self.run(self.call(scope, body))
+
+    async def call(self, scope, body):
+        messages = [{"type": "http.request", "body": body,
+                     "more_body": False}]
+        sent = []
+
+        async def receive():
+            if messages:
+                return messages.pop()
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            sent.append(message)
+
+        await self.asgi(scope, receive, send)
+        start = sent[0]
+        body = b"".join(message.get("body", b"") for message in sent[1:])
+        return self.asgi.app.response_class(
+                body,
+                status=start["status"],
+                headers=[(name.decode("latin1"), value.decode("latin1"))
+                         for name, value in start["headers"]],
+                )
+
+    def get(self, path, **kwargs):
+        return self.open(path, "GET", **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.open(path, "POST", **kwargs)
+
+    def delete(self, path, **kwargs):
+        return self.open(path, "DELETE", **kwargs)
+
+
+class AsyncMode:
+    """Serve the requests of a test case through create_asgi_app"""
+
+    def setUp(self):
+        super().setUp()
+        self.asgi = create_asgi_app(config_map.get("testing"))
+        self.app = self.asgi.app
+        self.client = ASGIClient(self.asgi)
+
+    def tearDown(self):
+        self.client.close()
+        super().tearDown()
+
+    def test_requests_use_async_engine(self):
+        """Test that route queries run on the aiosqlite engine"""
+        engine = self.app.extensions["async_engine"]
+        self.assertEqual(engine.dialect.driver, "aiosqlite")
+        with self.app.app_context():
+            sync_statements = []
+            event.listen(db.engine, "before_cursor_execute",
+                         lambda *args: sync_statements.append(args))
+            response = self.client.get('/schools/1')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(sync_statements, [])
+
+
+@unittest.skipIf(create_asgi_app is None, "aiosqlite is not installed")
+class TestSchoolAPIAsync(AsyncMode, test_school_api.TestSchoolAPI):
+    pass
+
+
+@unittest.skipIf(create_asgi_app is None, "aiosqlite is not installed")
+class TestStudentAPIAsync(AsyncMode, test_student_api.TestStudentAPI):
+    pass
+
+
+@unittest.skipIf(create_asgi_app is None, "aiosqlite is not installed")
+class TestWriteBatchingAsync(AsyncMode, test_batching.TestWriteBatching):
+    pass
+
+
+@unittest.skipIf(create_asgi_app is None, "aiosqlite is not installed")
+class TestChangeFeedAsync(AsyncMode, test_changes.TestChangeFeed):
+    pass
+
+
+if __name__ == '__main__':
+    unittest.main()
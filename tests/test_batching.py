@@ -0,0 +1,101 @@
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
+from sqlalchemy import event
+from config import Config
+from .base import BaseTest, db
+
+class TestWriteBatching(BaseTest):
+
+    def setUp(self):
+        # Wide enough that requests sent together land in one batch
+        for name, value in (("WRITE_BATCHING", True),
+                            ("WRITE_BATCH_WINDOW", 0.2)):
+            patcher = patch.object(Config, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        super().setUp()
+
+    def post_together(self, path, payloads):
+        with ThreadPoolExecutor(max_workers=len(payloads)) as pool:
+            return list(pool.map(
+                    lambda payload: self.client.post(path, json=payload),
+                    payloads))
+
+    def count_commits(self):
+        commits = []
+        with self.app.app_context():
+            event.listen(db.engine, "commit",
+                         lambda conn: commits.append(conn))
+        return commits
+
+    def student(self, student_id, school_id):
+        return {"id": student_id, "first_name": "Pau", "last_name": "Mas",
+                "school_id": school_id}
+
+    def test_batched_students_keep_their_own_status(self):
+        """Test that one batch reports 201, 409, 403 and 404 per request"""
+        commits = self.count_commits()
+        responses = self.post_together('/students', [
+            self.student("ST-000010", 2),
+            self.student("ST-000011", 2),
+            self.student("ST-000001", 2),
+            self.student("ST-000012", 1),
+            self.student("ST-000013", 99),
+            ])
+        self.assertEqual([r.status_code for r in responses],
+                         [201, 201, 409, 403, 404])
+        self.assertEqual(responses[0].get_json()["id"], "ST-000010")
+        self.assertIn("error", responses[2].get_json())
+        self.assertEqual(len(commits), 1)
+
+        school = self.client.get('/schools/2').get_json()
+        self.assertEqual(school["student_count"], 2)
+        self.assertEqual(sorted(s["id"] for s in school["students"]),
+                         ["ST-000010", "ST-000011"])
+
+    def test_batched_duplicates_within_a_batch(self):
+        """Test that only the first of two identical IDs is created"""
+        responses = self.post_together('/students', [
+            self.student("ST-000010", 2),
+            self.student("ST-000010", 2),
+            ])
+        self.assertEqual(sorted(r.status_code for r in responses),
+                         [201, 409])
+        self.assertEqual(self.client.get('/schools/2').get_json()
+                         ["student_count"], 1)
+
+    def test_bad_writes_fail_alone(self):
+        """Test that a malformed or failing write leaves its batch at 201"""
+        failing = {**self.student("ST-000012", 2), "first_name": {"x": 1}}
+        responses = self.post_together('/students', [
+            self.student("ST-000010", 2),
+            self.student("ST-000011", {"x": 1}),
+            failing,
+            self.student("ST-000013", 2),
+            ])
+        self.assertEqual([r.status_code for r in responses],
+                         [201, 400, 500, 201])
+        self.assertEqual(responses[1].get_json()["error"],
+                         "Invalid school_id")
+        self.assertEqual(self.client.get('/schools/2').get_json()
+                         ["student_count"], 2)
+
+        response = self.client.post('/schools', json={"name": "Escola Nova",
+                                                      "capacity": "5"})
+        self.assertEqual(response.status_code, 400)
+
+    def test_batched_schools(self):
+        """Test that batched schools get IDs and unique name errors"""
+        responses = self.post_together('/schools', [
+            {"name": "Escola Nova", "capacity": 5},
+            {"name": "Escola Gracia", "capacity": 5},
+            ])
+        self.assertEqual([r.status_code for r in responses], [201, 400])
+        self.assertEqual(responses[0].get_json()["name"], "Escola Nova")
+        new_id = responses[0].get_json()["id"]
+        self.assertEqual(self.client.get(f'/schools/{new_id}').status_code,
+                         200)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,23 @@
+import unittest
+from benchmarks.load import Dataset, run
+from .base import BaseTest
+
+class TestBenchmarks(BaseTest):
+
+    def test_every_route_is_benchmarked(self):
+        """Test the load harness covers and reports every API endpoint"""
+        report = run(self.app, Dataset(2, 2, seed=1), requests=4,
+                     concurrency=2)
+
+        endpoints = {rule.endpoint for rule in self.app.url_map.iter_rules()
+                     if rule.endpoint.startswith("api.")}
+        self.assertEqual(set(report), endpoints)
+        for result in report.values():
+            self.assertEqual(result["requests"], 4)
+            self.assertEqual(result["errors"], 0)
+            self.assertLessEqual(result["latency_ms"]["p50"],
+                                 result["latency_ms"]["p99"])
+            self.assertIn("mean", result["queries"])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+import sqlite3
+import unittest
+from app.cache import RecordCache
+from .base import BaseTest, db, count_queries
+
+class TestRecordCache(BaseTest):
+
+    def setUp(self):
+        super().setUp()
+        self.cache = self.app.extensions["record_cache"]
+
+    def test_repeated_lookups_hit(self):
+        """Test that a second lookup is served from the cache"""
+        first = self.client.get('/students/ST-000001')
+        with self.app.app_context():
+            with count_queries(self.app) as statements:
+                second = self.client.get('/students/ST-000001')
+        self.assertEqual(second.get_json(), first.get_json())
+        self.assertEqual(second.headers['ETag'], first.headers['ETag'])
+        self.assertEqual(statements, ["PRAGMA data_version"])
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+
+        response = self.client.get('/students/ST-000001', headers={
+            'If-None-Match': first.headers['ETag']})
+        self.assertEqual(response.status_code, 304)
+
+    def test_local_writes_invalidate(self):
+        """Test that a commit in this process makes cached records stale"""
+        self.client.get('/students/ST-000001')
+        self.client.get('/schools/1')
+        self.client.delete('/students/ST-000001')
+
+        self.assertEqual(self.client.get('/students/ST-000001').status_code,
+                         404)
+        data = self.client.get('/schools/1').get_json()
+        self.assertEqual([s["id"] for s in data["students"]], ["ST-000002"])
+
+    def test_other_process_writes_invalidate(self):
+        """Test that a commit from another connection is noticed"""
+        self.client.get('/students/ST-000002')
+        with self.app.app_context():
+            path = db.engine.url.database
+        other = sqlite3.connect(path)
+        other.execute("DELETE FROM student WHERE id = 'ST-000002'")
+        other.commit()
+        other.close()
+
+        self.assertEqual(self.client.get('/students/ST-000002').status_code,
+                         404)
+
+    def test_expiry_and_eviction(self):
+        """Test that entries expire after the TTL and the size is bounded"""
+        self.cache.ttl = 0
+        self.client.get('/schools/2')
+        self.client.get('/schools/2')
+        self.assertEqual(self.cache.hits, 0)
+
+        cache = RecordCache(max_entries=2, ttl=60)
+        for key in ("a", "b", "c"):
+            cache.put(key, 0, 0, key)
+        self.assertEqual(list(cache.entries), ["b", "c"])
+        # Read after the epoch moved on, so it must not be stored
+        cache.invalidate()
+        cache.put("d", 0, 0, "d")
+        self.assertNotIn("d", cache.entries)
+
+if __name__ == '__main__':
+    unittest.main()
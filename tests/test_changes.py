@@ -0,0 +1,124 @@
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from .base import BaseTest
+
+class TestChangeFeed(BaseTest):
+
+    def changes(self, since=0):
+        response = self.client.get(f'/changes?since={since}')
+        self.assertEqual(response.status_code, 200)
+        return response.get_json()
+
+    def test_writes_are_logged_in_order(self):
+        """Test that creations and deletions appear after the cursor"""
+        start = self.changes()["cursor"]
+        self.client.post('/schools', json={"name": "Petita", "capacity": 3})
+        self.client.post('/students', json={
+            "id": "ST-000003", "first_name": "Pau", "last_name": "Mas",
+            "school_id": 2,
+            })
+        self.client.delete('/students/ST-000001')
+
+        data = self.changes(start)
+        self.assertEqual(
+                [(c["resource"], c["action"], c["id"])
+                 for c in data["changes"]],
+                [("schools", "created", 3),
+                 ("students", "created", "ST-000003"),
+                 ("students", "deleted", "ST-000001")])
+        self.assertEqual(data["cursor"], data["changes"][-1]["cursor"])
+        self.assertEqual(self.changes(data["cursor"])["changes"], [])
+
+    def test_rejected_writes_are_not_logged(self):
+        """Test that failed creations leave no trace in the feed"""
+        start = self.changes()["cursor"]
+        self.client.post('/students', json={
+            "id": "ST-000001", "first_name": "Pau", "last_name": "Mas",
+            "school_id": 2,
+            })
+        self.client.post('/students', json={
+            "id": "ST-000009", "first_name": "Pau", "last_name": "Mas",
+            "school_id": 1,
+            })
+        self.assertEqual(self.changes(start),
+                         {"changes": [], "cursor": start})
+
+    def test_bulk_writes_are_logged(self):
+        """Test bulk creation, bulk deletion and school deletion entries"""
+        start = self.changes()["cursor"]
+        self.client.post('/students/bulk', json=[
+            {"id": "ST-000010", "first_name": "Pau", "last_name": "Mas",
+             "school_id": 2},
+            ])
+        self.client.delete('/students', json={"ids": ["ST-000010"]})
+        self.client.delete('/schools/1')
+
+        entries = [(c["resource"], c["action"], c["id"], c["school_id"])
+                   for c in self.changes(start)["changes"]]
+        self.assertEqual(entries, [
+            ("students", "created", "ST-000010", 2),
+            ("students", "deleted", "ST-000010", 2),
+            ("students", "deleted", "ST-000001", 1),
+            ("students", "deleted", "ST-000002", 1),
+            ("schools", "deleted", 1, 1),
+            ])
+
+    def test_pruned_cursor_is_gone(self):
+        """Test that a cursor into pruned entries is refused with 410"""
+        for index in range(4):
+            self.client.post('/schools', json={"name": f"Escola {index}",
+                                               "capacity": 3})
+        cursors = [c["cursor"] for c in self.changes()["changes"]]
+
+        result = self.app.test_cli_runner().invoke(
+                args=["prune-changes", "--keep", "2"])
+        self.assertIn(f"Pruned {len(cursors) - 2} changes", result.output)
+
+        self.assertEqual(self.changes(cursors[-3])["changes"][0]["cursor"],
+                         cursors[-2])
+        for path in ('/changes?since=%s', '/changes/stream?since=%s'):
+            response = self.client.get(path % cursors[-4])
+            self.assertEqual(response.status_code, 410)
+        # Starting over reads from the oldest retained change
+        self.assertEqual([c["cursor"] for c in self.changes()["changes"]],
+                         cursors[-2:])
+
+    def test_changes_invalid_cursor(self):
+        """Test that malformed cursors are rejected"""
+        self.assertEqual(self.client.get('/changes?since=x').status_code,
+                         400)
+        response = self.client.get('/changes/stream?timeout=-1')
+        self.assertEqual(response.status_code, 400)
+
+    def test_event_stream(self):
+        """Test that the SSE stream replays changes after Last-Event-ID"""
+        start = self.changes()["cursor"]
+        self.client.delete('/students/ST-000001')
+        self.client.delete('/students/ST-000002')
+
+        response = self.client.get('/changes/stream?timeout=0',
+                                   headers={'Last-Event-ID': str(start)})
+        self.assertEqual(response.mimetype, 'text/event-stream')
+        events = response.get_data(as_text=True).strip().split("\n\n")
+        self.assertEqual(len(events), 2)
+        self.assertTrue(events[0].startswith(f"id: {start + 1}\n"
+                                             "event: change\n"))
+        self.assertIn('"id":"ST-000002"', events[1])
+
+        response = self.client.get('/changes/stream?timeout=0')
+        self.assertEqual(response.get_data(), b"")
+
+    def test_event_stream_follows_new_writes(self):
+        """Test that a write made while streaming is pushed before timeout"""
+        self.app.config["CHANGES_POLL_INTERVAL"] = 0.05
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            stream = pool.submit(lambda: self.client.get(
+                    '/changes/stream?timeout=1').get_data(as_text=True))
+            time.sleep(0.2)
+            self.client.delete('/students/ST-000001')
+            body = stream.result()
+        self.assertIn('"id":"ST-000001"', body)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,19 @@
+import unittest
+from .base import BaseTest, db
+
+class TestEngine(BaseTest):
+
+    def pragma(self, name):
+        with self.app.app_context():
+            return db.session.execute(db.text(f"PRAGMA {name}")).scalar()
+
+    def test_sqlite_pragmas_applied(self):
+        """Test that every connection is tuned for concurrent access"""
+        self.assertEqual(self.pragma("journal_mode"), "wal")
+        self.assertEqual(self.pragma("busy_timeout"),
+                         self.app.config["SQLITE_PRAGMAS"]["busy_timeout"])
+        # NORMAL
+        self.assertEqual(self.pragma("synchronous"), 1)
+
+if __name__ == '__main__':
+    unittest.main()
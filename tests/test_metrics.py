@@ -0,0 +1,49 @@
+import unittest
+from unittest.mock import patch
+from app import create_app
+from config import Config, config_map
+from .base import BaseTest
+
+class TestMetrics(BaseTest):
+
+    def setUp(self):
+        with patch.object(Config, "METRICS_ENABLED", True):
+            super().setUp()
+
+    def test_server_timing_header(self):
+        """Test that responses report request and SQL time"""
+        response = self.client.get('/schools/1')
+        timing = response.headers['Server-Timing']
+        self.assertIn("app;dur=", timing)
+        # The school, its students and the record cache coherence check
+        self.assertIn('desc="3 queries"', timing)
+        response = self.client.get('/schools/1')
+        self.assertIn('desc="1 queries"', response.headers['Server-Timing'])
+
+    def test_metrics_endpoint(self):
+        """Test that /metrics exposes per-endpoint Prometheus series"""
+        self.client.get('/schools')
+        self.client.get('/schools')
+        self.client.get('/students/missing')
+
+        response = self.client.get('/metrics')
+        body = response.get_data(as_text=True)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('http_request_duration_seconds_count'
+                      '{endpoint="api.get_schools",method="GET"} 2', body)
+        self.assertIn('http_responses_total{endpoint="api.get_student_by_id",'
+                      'method="GET",status="404"} 1', body)
+        self.assertIn('db_statements_total{endpoint="api.get_schools",'
+                      'method="GET"} 6', body)
+        self.assertIn('record_cache_requests_total{result="miss"} 1', body)
+
+    def test_disabled_by_default(self):
+        """Test that nothing is instrumented unless enabled"""
+        app = create_app(config_map.get("testing"))
+        self.assertNotIn("metrics", app.extensions)
+        response = app.test_client().get('/schools')
+        self.assertNotIn('Server-Timing', response.headers)
+        self.assertEqual(app.test_client().get('/metrics').status_code, 404)
+
+if __name__ == '__main__':
+    unittest.main()
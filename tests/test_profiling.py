@@ -0,0 +1,128 @@
+import io
+import marshal
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+from config import Config
+from .base import BaseTest
+
+class TestProfiling(BaseTest):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        settings = (
+            ("PROFILING_ENABLED", True),
+            ("PROFILE_DIR", self.directory.name),
+            ("PROFILE_TOKEN", "secret"),
+            ("PROFILE_KEEP", 2),
+        )
+        for name, value in settings:
+            patcher = patch.object(Config, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        super().setUp()
+
+    def profiled_get(self, path):
+        return self.client.get(path, headers={"X-Profile": "secret"})
+
+    def test_header_triggers_profile(self):
+        """Test that a request sending the token is profiled and listed"""
+        response = self.profiled_get('/schools/1')
+        self.assertEqual(response.status_code, 200)
+        profile_id = response.headers["X-Profile-Id"]
+
+        index = self.profiled_get('/profiles').get_json()
+        self.assertEqual([p["id"] for p in index], [profile_id])
+        self.assertEqual(index[0]["endpoint"], "api.get_school_by_id")
+        self.assertEqual(index[0]["trigger"], "header")
+        self.assertNotIn("timeline", index[0])
+
+        report = self.profiled_get(f'/profiles/{profile_id}').get_json()
+        statements = [entry["statement"] for entry in report["timeline"]]
+        self.assertEqual(report["statements"], len(statements))
+        self.assertTrue(any("FROM student" in s for s in statements))
+        self.assertTrue(report["functions"])
+
+        dump = self.profiled_get(f'/profiles/{profile_id}/pstats')
+        self.assertEqual(dump.status_code, 200)
+        self.assertIsInstance(marshal.load(io.BytesIO(dump.get_data())), dict)
+
+    def test_untriggered_requests_are_not_profiled(self):
+        """Test that requests without the right token leave no profile"""
+        self.assertNotIn("X-Profile-Id", self.client.get('/schools').headers)
+        response = self.client.get('/schools', headers={"X-Profile": "guess"})
+        self.assertNotIn("X-Profile-Id", response.headers)
+        self.assertEqual(self.profiled_get('/profiles').get_json(), [])
+        self.assertEqual(self.profiled_get('/profiles/missing').status_code,
+                         404)
+
+    def test_reports_need_the_token(self):
+        """Test that reports are private and keep no query string"""
+        response = self.profiled_get('/students/search?query=Jordi')
+        profile_id = response.headers["X-Profile-Id"]
+        for path in ('/profiles', f'/profiles/{profile_id}',
+                     f'/profiles/{profile_id}/pstats'):
+            self.assertEqual(self.client.get(path).status_code, 403)
+            response = self.client.get(path, headers={"X-Profile": "guess"})
+            self.assertEqual(response.status_code, 403)
+
+        report = self.profiled_get(f'/profiles/{profile_id}').get_json()
+        self.assertEqual(report["path"], "/students/search")
+        with open(os.path.join(self.directory.name,
+                               profile_id + ".json")) as file:
+            self.assertNotIn("Jordi", file.read())
+
+    def test_sampling_and_retention(self):
+        """Test that sampled requests are profiled and old ones pruned"""
+        self.app.config["PROFILE_SAMPLE_RATE"] = 100
+        ids = [self.client.get('/schools').headers["X-Profile-Id"]
+               for _ in range(3)]
+        index = self.profiled_get('/profiles').get_json()
+        self.assertEqual(len(index), 2)
+        self.assertEqual({p["trigger"] for p in index}, {"sample"})
+        self.assertNotIn(ids[0], [p["id"] for p in index])
+        self.assertEqual(len(os.listdir(self.directory.name)), 4)
+
+class TestProfilingWithoutToken(BaseTest):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        settings = (
+            ("PROFILING_ENABLED", True),
+            ("PROFILE_DIR", self.directory.name),
+            ("PROFILE_TOKEN", None),
+        )
+        for name, value in settings:
+            patcher = patch.object(Config, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        with self.assertLogs("app", "WARNING"):
+            super().setUp()
+
+    def test_only_sampled_and_not_served(self):
+        """Test that without a token there is only sampling, nothing served"""
+        response = self.client.get('/schools', headers={"X-Profile": "1"})
+        self.assertNotIn("X-Profile-Id", response.headers)
+        response = self.client.get('/profiles', headers={"X-Profile": "1"})
+        self.assertEqual(response.status_code, 404)
+
+        self.app.config["PROFILE_SAMPLE_RATE"] = 100
+        profile_id = self.client.get('/schools').headers["X-Profile-Id"]
+        response = self.client.get(f'/profiles/{profile_id}')
+        self.assertEqual(response.status_code, 404)
+        self.assertIn(profile_id + ".json", os.listdir(self.directory.name))
+
+class TestProfilingDisabled(BaseTest):
+
+    def test_disabled_by_default(self):
+        """Test that nothing is profiled or exposed unless enabled"""
+        response = self.client.get('/schools', headers={"X-Profile": "1"})
+        self.assertNotIn("X-Profile-Id", response.headers)
+        self.assertEqual(self.client.get('/profiles').status_code, 404)
+        self.assertNotIn("profiles", self.app.extensions)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,140 @@
+import re
+import unittest
+from flask import has_request_context, request
+from sqlalchemy import event
+from benchmarks.load import SCENARIOS, Dataset, seed
+from app import create_app
+from config import config_map
+from .base import db
+
+SCHOOLS = 50
+STUDENTS = 2000
+# Tables that grow with the data, a scan of any of them is a regression
+LARGE_TABLES = {"school", "student", "change"}
+# Statements allowed to scan a large table, by name: the endpoint running
+# them, the table and a pattern of the statement
+ALLOWED_SCANS = {
+    # Read whole tables by design
+    "school export": ("api.export_schools", "school", r"FROM school ORDER BY"),
+    "student export": ("api.export_students", "student",
+                       r"FROM student ORDER BY"),
+    # Totals and the histogram aggregate every school
+    "occupancy totals": ("api.get_occupancy", "school", r"\bcount\("),
+    "occupancy histogram": ("api.get_occupancy", "school", r"GROUP BY"),
+    "occupancy listing": ("api.get_occupancy", "school",
+                          r"FROM school( ORDER BY school.id LIMIT|$)"),
+    # First pages of keyset listings walk the primary key in order and stop
+    # after LIMIT rows
+    "school listing first page": ("api.get_schools", "school",
+                                  r"FROM school ORDER BY school.id LIMIT"),
+    "student listing first page": ("api.get_students", "student",
+                                   r"FROM student ORDER BY student.id LIMIT"),
+    # Queries shorter than a trigram fall back to LIKE '%query%', which no
+    # index can serve, so these scan until LIMIT matches or the table ends
+    "short school search": ("api.search_schools", "school", r"LIKE"),
+    "short student search": ("api.search_students", "student", r"LIKE"),
+}
+# Endpoints allowed to run no statement at all for the requests below,
+# none so far: every route's statements must reach the plan check
+NO_STATEMENTS = set()
+# Requests beyond the benchmark scenarios, for plans they do not reach
+EXTRA_REQUESTS = (
+    ("GET", "/schools?limit=10&after=5", None),
+    ("GET", "/schools?fields=id,name&include=students&limit=10", None),
+    ("GET", "/students?limit=10&after=B00000010", None),
+    ("GET", "/stats/occupancy?limit=10&after=5", None),
+    ("GET", "/changes?since=1&limit=10", None),
+    ("POST", "/students/transfer", {"from_school_id": 3, "school_id": 4}),
+    ("GET", "/schools/search?query=1", None),
+    ("GET", "/students/search?query=Jo", None),
+)
+# SQLite before 3.36 writes "SCAN TABLE x"
+SCAN = re.compile(r"\bSCAN (?:TABLE )?(\w+)")
+PLANNED = ("SELECT", "UPDATE", "DELETE", "INSERT INTO change", "WITH")
+
+class TestQueryPlans(unittest.TestCase):
+
+    def setUp(self):
+        self.app = create_app(config_map.get("testing"))
+        self.client = self.app.test_client()
+        with self.app.app_context():
+            db.create_all()
+            seed(SCHOOLS, STUDENTS)
+
+    def tearDown(self):
+        with self.app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+    def capture(self):
+        """Run every route, returning (endpoint, statement, parameters)"""
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, parameters,
+                                  context, executemany):
+            if (has_request_context() and not executemany
+                    and statement.lstrip().startswith(PLANNED)):
+                statements.append((request.endpoint, statement, parameters))
+
+        requests = [(method, *build(Dataset(SCHOOLS, STUDENTS, seed=1)))
+                    for method, build in SCENARIOS.values()]
+        with self.app.app_context():
+            engines = list(db.engines.values())
+            for engine in engines:
+                event.listen(engine, "before_cursor_execute",
+                             before_cursor_execute)
+            try:
+                for method, path, body in requests + list(EXTRA_REQUESTS):
+                    response = self.client.open(path, method=method,
+                                                json=body)
+                    response.get_data()
+                    self.assertLess(response.status_code, 500, path)
+            finally:
+                for engine in engines:
+                    event.remove(engine, "before_cursor_execute",
+                                 before_cursor_execute)
+        return statements
+
+    def scans(self, statement, parameters):
+        """Large tables a statement scans"""
+        with db.engine.connect() as connection:
+            plan = connection.exec_driver_sql(
+                    "EXPLAIN QUERY PLAN " + statement, parameters).all()
+        return {match.group(1) for row in plan
+                for match in [SCAN.match(row[-1])]
+                if match and match.group(1) in LARGE_TABLES}
+
+    def test_every_route_is_covered(self):
+        """Test that the plans below come from every API endpoint"""
+        endpoints = {rule.endpoint for rule in self.app.url_map.iter_rules()
+                     if rule.endpoint.startswith("api.")}
+        captured = {endpoint for endpoint, _, _ in self.capture()}
+        self.assertEqual(captured, endpoints - NO_STATEMENTS)
+
+    def test_no_full_table_scans(self):
+        """Test that no route statement scans a large table unless allowed"""
+        regressions = []
+        used = set()
+        statements = self.capture()
+        with self.app.app_context():
+            for endpoint, statement, parameters in statements:
+                statement = " ".join(statement.split())
+                for table in self.scans(statement, parameters):
+                    allowed = {name for name, (allowed_endpoint,
+                                               allowed_table, pattern)
+                               in ALLOWED_SCANS.items()
+                               if (allowed_endpoint, allowed_table)
+                               == (endpoint, table)
+                               and re.search(pattern, statement)}
+                    if not allowed:
+                        regressions.append(f"{endpoint} scans {table}: "
+                                           f"{statement}")
+                    used |= allowed
+        self.assertEqual(regressions, [], "\n".join(regressions))
+        # Allowed scans were seen at all, so the plans are being read
+        self.assertTrue(used, "No scan found in any query plan")
+        # An entry no statement needs any more must go
+        self.assertEqual(set(ALLOWED_SCANS) - used, set())
+
+if __name__ == '__main__':
+    unittest.main()
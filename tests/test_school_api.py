@@ -1,4 +1,5 @@
-from .base import BaseTest, db, Student, School
+from app.routes.fragments import FragmentCache
+from .base import BaseTest, db, count_queries, Student, School
 
 class TestSchoolAPI(BaseTest):
 
@@ -41,6 +42,21 @@ class TestSchoolAPI(BaseTest):
         self.assertEqual(response.status_code, 404)
         self.assertIn("error", response.get_data(as_text=True))
 
+    def test_delete_school_is_set_based(self):
+        """Test that a school's students go in one DELETE, not one per row"""
+        with self.app.app_context():
+            with count_queries(self.app) as statements:
+                response = self.client.delete('/schools/1')
+            self.assertEqual(response.status_code, 200)
+            deletes = [s for s in statements if s.startswith("DELETE")]
+            self.assertEqual(len(deletes), 2)
+            remaining = db.session.execute(
+                    db.select(Student).where(Student.school_id == 1)).all()
+            self.assertEqual(remaining, [])
+
+        response = self.client.get('/students/search?query=pujol')
+        self.assertEqual(response.get_json(), [])
+
     def test_delete_school_nonexistent(self):
         """Test deleting a non-existent school"""
         school_id = 58
@@ -57,6 +73,22 @@ class TestSchoolAPI(BaseTest):
         self.assertIsInstance(data, list)
         self.assertEqual(len(data), 2)
 
+    def test_get_schools_paginated(self):
+        """Verify the school list can be fetched page by page"""
+        response = self.client.get('/schools?limit=1')
+        data = response.get_json()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([s['id'] for s in data], [1])
+        cursor = response.headers['X-Next-Cursor']
+
+        response = self.client.get(f'/schools?limit=1&after={cursor}')
+        data = response.get_json()
+        self.assertEqual([s['id'] for s in data], [2])
+        self.assertNotIn('X-Next-Cursor', response.headers)
+
+        response = self.client.get('/schools?after=abc')
+        self.assertEqual(response.status_code, 400)
+
     def test_get_schools_nesting_requirement(self):
         """Verify students are nested inside the school objects"""
         response = self.client.get('/schools')
@@ -69,6 +101,77 @@ class TestSchoolAPI(BaseTest):
         self.assertEqual(len(gracia['students']), 2)
         self.assertEqual(gracia['students'][0]['first_name'], "Jordi")
 
+    def test_get_schools_sparse_fields(self):
+        """Verify ?fields= limits the columns and skips the students"""
+        with self.app.app_context():
+            with count_queries(self.app) as statements:
+                response = self.client.get('/schools?fields=name')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()[0],
+                         {"id": 1, "name": "Escola Gracia"})
+        self.assertFalse(any("FROM student" in s for s in statements))
+        self.assertFalse(any("capacity" in s for s in statements))
+
+    def test_get_schools_include_students(self):
+        """Verify ?include=students embeds students next to chosen fields"""
+        response = self.client.get(
+                '/schools?fields=student_count&include=students')
+        gracia = response.get_json()[0]
+        self.assertEqual(sorted(gracia),
+                         ["id", "student_count", "students"])
+        self.assertEqual([s['id'] for s in gracia['students']],
+                         ["ST-000001", "ST-000002"])
+
+        response = self.client.get('/schools?include=students&limit=1')
+        self.assertEqual(sorted(response.get_json()[0]),
+                         ["capacity", "id", "name", "student_count",
+                          "students"])
+
+    def test_get_schools_invalid_fields(self):
+        """Verify unknown fields and includes are rejected"""
+        for query in ("fields=secret", "include=teachers"):
+            response = self.client.get(f'/schools?{query}')
+            self.assertEqual(response.status_code, 400)
+            response = self.client.get(f'/schools/1?{query}')
+            self.assertEqual(response.status_code, 400)
+
+    def test_get_school_by_id_sparse_fields(self):
+        """Verify a single school honours fields and include"""
+        response = self.client.get('/schools/1?fields=name,capacity')
+        self.assertEqual(response.get_json(),
+                         {"id": 1, "name": "Escola Gracia", "capacity": 2})
+        self.assertIn('ETag', response.headers)
+
+        response = self.client.get('/schools/1?fields=name&include=students')
+        self.assertEqual(len(response.get_json()['students']), 2)
+
+    def test_get_schools_query_count_is_flat(self):
+        """Verify listing schools does not issue one query per school"""
+        with self.app.app_context():
+            with count_queries(self.app) as statements:
+                self.client.get('/schools')
+            small = len(statements)
+
+            for i in range(20):
+                school = School(name=f"Escola {i}", capacity=10)
+                school.students = [
+                    Student(id=f"ST-{i + 100:03}{j:03}",
+                            first_name="Nom",
+                            last_name="Cognom",
+                            )
+                    for j in range(3)
+                ]
+                db.session.add(school)
+            db.session.commit()
+
+            with count_queries(self.app) as statements:
+                response = self.client.get('/schools')
+            large = len(statements)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.get_json()), 22)
+        self.assertEqual(small, large)
+
     def test_get_school_by_id_successful(self):
         """Test getting a school by id successfully"""
         with self.app.app_context():
@@ -96,6 +199,137 @@ class TestSchoolAPI(BaseTest):
         self.assertEqual(response.status_code, 404)
         self.assertIn("error", response.get_data(as_text=True))
 
+    def test_get_schools_not_modified(self):
+        """Verify a current ETag is answered with 304 from one lookup"""
+        response = self.client.get('/schools')
+        etag = response.headers['ETag']
+
+        with self.app.app_context():
+            with count_queries(self.app) as statements:
+                response = self.client.get('/schools',
+                                           headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(len(statements), 1)
+
+        self.client.post('/schools', json={"name": "Escola Nova",
+                                           "capacity": 5})
+        response = self.client.get('/schools',
+                                   headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+
+    def test_get_school_by_id_not_modified(self):
+        """Verify each school's ETag only changes with its own students"""
+        gracia = self.client.get('/schools/1').headers['ETag']
+        eixample = self.client.get('/schools/2').headers['ETag']
+
+        self.client.post('/students', json={
+            "id": "ST-000003",
+            "first_name": "Maria",
+            "last_name": "Vila",
+            "school_id": 2,
+        })
+
+        response = self.client.get('/schools/1',
+                                   headers={'If-None-Match': gracia})
+        self.assertEqual(response.status_code, 304)
+        response = self.client.get('/schools/2',
+                                   headers={'If-None-Match': eixample})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()['student_count'], 1)
+
+        response = self.client.get('/schools/58',
+                                   headers={'If-None-Match': gracia})
+        self.assertEqual(response.status_code, 404)
+
+    def test_export_schools(self):
+        """Test streaming every school without its students"""
+        response = self.client.get('/export/schools?format=csv')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('schools.csv', response.headers['Content-Disposition'])
+        self.assertEqual(response.get_data(as_text=True).splitlines(), [
+            "id,name,capacity,student_count",
+            "1,Escola Gracia,2,2",
+            "2,Escola Eixample,100,0",
+            ])
+
+    def test_occupancy(self):
+        """Test per-school and global occupancy with its histogram"""
+        response = self.client.get('/stats/occupancy')
+        self.assertEqual(response.status_code, 200)
+        data = response.get_json()
+        self.assertEqual(data["schools"], [
+            {"id": 1, "name": "Escola Gracia", "capacity": 2,
+             "student_count": 2, "utilization": 1.0},
+            {"id": 2, "name": "Escola Eixample", "capacity": 100,
+             "student_count": 0, "utilization": 0.0},
+            ])
+        self.assertEqual(data["totals"]["schools"], 2)
+        self.assertEqual(data["totals"]["capacity"], 102)
+        self.assertEqual(data["totals"]["student_count"], 2)
+        self.assertAlmostEqual(data["totals"]["utilization"], 2 / 102)
+        self.assertEqual([b["schools"] for b in data["histogram"]],
+                         [1, 0, 0, 0, 1])
+
+        self.client.delete('/students/ST-000001')
+        data = self.client.get('/stats/occupancy?limit=1').get_json()
+        self.assertEqual(data["schools"][0]["utilization"], 0.5)
+        self.assertEqual([b["schools"] for b in data["histogram"]],
+                         [1, 1, 0, 0, 0])
+
+    def test_occupancy_skips_students_table(self):
+        """Test that the report never scans students"""
+        with self.app.app_context():
+            with count_queries(self.app) as statements:
+                response = self.client.get('/stats/occupancy')
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(any("FROM student" in s for s in statements))
+        etag = response.headers['ETag']
+        response = self.client.get('/stats/occupancy',
+                                   headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+
+    def test_listing_reuses_fragments(self):
+        """Test that an unchanged listing is assembled from the cache"""
+        first = self.client.get('/schools').get_data()
+        with self.app.app_context():
+            with count_queries(self.app) as statements:
+                response = self.client.get('/schools')
+        self.assertEqual(response.get_data(), first)
+        self.assertEqual(len(response.get_json()[0]["students"]), 2)
+        self.assertFalse(any("FROM student" in s for s in statements))
+
+    def test_write_reencodes_only_its_school(self):
+        """Test that a new student invalidates just its own school"""
+        self.client.get('/schools')
+        cache = self.app.extensions["school_fragments"]
+        untouched = cache.entries[1]
+        self.client.post('/students', json={
+            "id": "ST-000003", "first_name": "Pau", "last_name": "Mas",
+            "school_id": 2,
+            })
+
+        data = self.client.get('/schools').get_json()
+        self.assertEqual(data[1]["students"][0]["id"], "ST-000003")
+        self.assertIs(cache.entries[1], untouched)
+
+        self.client.delete('/schools/2')
+        self.assertEqual(len(self.client.get('/schools').get_json()), 1)
+        self.assertNotIn(2, cache.entries)
+
+    def test_fragment_cache_is_bounded(self):
+        """Test that least recently used fragments are evicted first"""
+        cache = FragmentCache(max_bytes=100)
+        for school_id in (1, 2):
+            cache.put(school_id, 1, b"x" * 40)
+        self.assertEqual(cache.get(1, 1), b"x" * 40)
+        self.assertIsNone(cache.get(1, 2))
+        cache.put(3, 1, b"y" * 40)
+        self.assertEqual(list(cache.entries), [1, 3])
+        self.assertLessEqual(cache.size, 100)
+        cache.put(4, 1, b"z" * 200)
+        self.assertNotIn(4, cache.entries)
+
     def test_search_school_successful(self):
         """Test searching for a school by partial name."""
         response = self.client.get('/schools/search?query=Grac')
@@ -104,6 +338,34 @@ class TestSchoolAPI(BaseTest):
         self.assertEqual(len(data), 1)
         self.assertEqual(data[0]['name'], "Escola Gracia")
 
+    def test_search_school_uses_index(self):
+        """Test that searches are answered from the trigram index"""
+        with self.app.app_context():
+            with count_queries(self.app) as statements:
+                response = self.client.get('/schools/search?query=eixa')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()[0]['name'], "Escola Eixample")
+        self.assertTrue(any("MATCH" in s for s in statements))
+
+    def test_search_school_relevance_and_limit(self):
+        """Test that better matches come first and results are capped"""
+        self.client.post('/schools', json={"name": "Gracia", "capacity": 5})
+
+        response = self.client.get('/schools/search?query=gracia')
+        names = [s['name'] for s in response.get_json()]
+        self.assertEqual(names, ["Gracia", "Escola Gracia"])
+
+        response = self.client.get('/schools/search?query=escola&limit=1')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.get_json()), 1)
+
+    def test_search_school_short_query(self):
+        """Test that queries shorter than a trigram still match substrings"""
+        response = self.client.get('/schools/search?query=ei')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([s['name'] for s in response.get_json()],
+                         ["Escola Eixample"])
+
     def test_search_school_incomplete(self):
         """
         Test searching for a school by partial name when no arguments are
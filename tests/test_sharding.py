@@ -0,0 +1,238 @@
+import os
+import tempfile
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
+from sqlalchemy import select
+from app import create_app
+from app.asgi import AsyncApp
+from app.models.sharding import on_shard, shard_key
+from config import Config, config_map
+from .base import db, School, Student
+from app.models.models import Claim
+
+SHARDS = 3
+
+class TestSharding(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        binds = {
+            shard_key(shard):
+                "sqlite:///" + os.path.join(directory.name, f"{shard}.db")
+            for shard in range(1, SHARDS)
+        }
+        patcher = patch.object(Config, "SQLALCHEMY_BINDS", binds)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.app = create_app(config_map.get("testing"))
+        self.client = self.app.test_client()
+        self.schools = []
+        for index in range(6):
+            response = self.client.post('/schools', json={
+                "name": f"Escola {index}", "capacity": 10})
+            self.assertEqual(response.status_code, 201)
+            self.schools.append(response.get_json()["id"])
+        for index, school_id in enumerate(self.schools):
+            response = self.client.post('/students', json={
+                "id": f"ST-{index:06d}", "first_name": "Pau",
+                "last_name": f"Mas{index}", "school_id": school_id})
+            self.assertEqual(response.status_code, 201)
+
+    def tearDown(self):
+        with self.app.app_context():
+            db.session.remove()
+            for engine in db.engines.values():
+                db.metadata.drop_all(engine)
+                engine.dispose()
+        # The extension keeps one metadata per bind key it has seen, which
+        # would leave later apps without shards failing on create_all
+        for key in Config.SQLALCHEMY_BINDS:
+            db.metadatas.pop(key, None)
+
+    def rows_on(self, shard, model):
+        with self.app.app_context(), on_shard(shard):
+            return db.session.execute(select(model.id)).scalars().all()
+
+    def test_rows_are_placed_by_school(self):
+        """Test that each school and its students live in school_id % N"""
+        self.assertEqual(len(set(self.schools)), 6)
+        for shard in range(SHARDS):
+            schools = self.rows_on(shard, School)
+            self.assertEqual(len(schools), 2)
+            self.assertTrue(all(s % SHARDS == shard for s in schools))
+            self.assertEqual(len(self.rows_on(shard, Student)), 2)
+
+        school_id = self.schools[4]
+        response = self.client.get(f'/schools/{school_id}')
+        self.assertEqual(response.get_json()["students"][0]["id"],
+                         "ST-000004")
+        response = self.client.get('/students/ST-000004')
+        self.assertEqual(response.get_json()["school_id"], school_id)
+
+    def test_lists_merge_shards_in_order(self):
+        """Test that paginated lists walk every shard in id order"""
+        seen, cursor = [], None
+        while True:
+            path = '/schools?limit=4&include=students'
+            response = self.client.get(
+                    path + (f'&after={cursor}' if cursor else ''))
+            seen.extend(response.get_json())
+            cursor = response.headers.get('X-Next-Cursor')
+            if cursor is None:
+                break
+        self.assertEqual([s["id"] for s in seen], sorted(self.schools))
+        self.assertTrue(all(len(s["students"]) == 1 for s in seen))
+
+        response = self.client.get('/students?limit=5')
+        self.assertEqual([s["id"] for s in response.get_json()],
+                         [f"ST-{index:06d}" for index in range(5)])
+        self.assertEqual(response.headers['X-Next-Cursor'], "ST-000004")
+
+    def test_search_and_lookup_span_shards(self):
+        """Test that search and lookup gather results from every shard"""
+        response = self.client.get('/students/search?query=Mas')
+        self.assertEqual(len(response.get_json()), 6)
+        response = self.client.get('/schools/search?query=Escola&limit=4')
+        self.assertEqual(len(response.get_json()), 4)
+        response = self.client.post('/students/lookup', json={
+            "ids": ["ST-000005", "ST-000000", "ST-999999"]})
+        self.assertEqual(response.get_json()["missing"], ["ST-999999"])
+        self.assertEqual([s["id"] for s in response.get_json()["students"]],
+                         ["ST-000005", "ST-000000"])
+
+    def test_student_ids_are_unique_across_shards(self):
+        """Test that an ID taken in one shard is refused in the others"""
+        other = next(s for s in self.schools if s % SHARDS != 0)
+        response = self.client.post('/students', json={
+            "id": "ST-000000", "first_name": "Pau", "last_name": "Mas",
+            "school_id": other})
+        self.assertEqual(response.status_code, 409)
+        response = self.client.post('/students/bulk', json=[
+            {"id": "ST-000001", "first_name": "Pau", "last_name": "Mas",
+             "school_id": other},
+            {"id": "ST-000100", "first_name": "Pau", "last_name": "Mas",
+             "school_id": other},
+            ])
+        self.assertEqual([r["status"] for r in response.get_json()["results"]],
+                         [409, 201])
+
+    def test_transfers_stay_on_their_shard(self):
+        """Test that students only move between schools of one shard"""
+        source, target = self.schools[0], self.schools[3]
+        self.assertEqual(source % SHARDS, target % SHARDS)
+        response = self.client.post('/students/transfer', json={
+            "from_school_id": source, "school_id": target})
+        self.assertEqual(response.get_json(), {"moved": 1, "school_id": target})
+        self.assertEqual(self.rows_on(target % SHARDS, Student),
+                         ["ST-000000", "ST-000003"])
+
+        other = self.schools[1]
+        response = self.client.post('/students/transfer', json={
+            "ids": ["ST-000001"], "school_id": target})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post('/students/transfer', json={
+            "from_school_id": other, "school_id": target})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("ST-000001", self.rows_on(other % SHARDS, Student))
+
+    def test_school_names_are_unique_across_shards(self):
+        """Test that a name taken in one shard is refused in the others"""
+        for _ in range(SHARDS):
+            response = self.client.post('/schools', json={
+                "name": "Escola 0", "capacity": 10})
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(response.get_json()["error"],
+                             "School name must be unique")
+        totals = self.client.get('/stats/occupancy').get_json()["totals"]
+        self.assertEqual(totals["schools"], 6)
+
+    def test_concurrent_creates_claim_their_keys(self):
+        """Test that racing creates on different shards keep keys unique"""
+        def create(index):
+            school_id = self.schools[index % SHARDS]
+            return (self.client.post('/students', json={
+                        "id": "ST-000100", "first_name": "Pau",
+                        "last_name": "Mas", "school_id": school_id})
+                    .status_code,
+                    self.client.post('/schools', json={
+                        "name": "Escola Nova", "capacity": 10})
+                    .status_code)
+
+        with ThreadPoolExecutor(max_workers=6) as pool:
+            statuses = list(pool.map(create, range(6)))
+        self.assertEqual(sorted(s for s, _ in statuses), [201] + [409] * 5)
+        self.assertEqual(sorted(s for _, s in statuses), [201] + [400] * 5)
+        totals = self.client.get('/stats/occupancy').get_json()["totals"]
+        self.assertEqual(totals["schools"], 7)
+        self.assertEqual(totals["student_count"], 7)
+
+    def test_claims_follow_creates_and_deletes(self):
+        """Test that a held key is refused and a deleted one freed"""
+        with self.app.app_context():
+            self.assertEqual(db.session.execute(
+                    select(Claim.key).where(Claim.resource == "schools")
+                    ).scalars().all(), [f"Escola {i}" for i in range(6)])
+            db.session.add(Claim(resource="students", key="ST-000100"))
+            db.session.commit()
+        student = {"id": "ST-000100", "first_name": "Pau",
+                   "last_name": "Mas", "school_id": self.schools[1]}
+        response = self.client.post('/students', json=student)
+        self.assertEqual(response.status_code, 409)
+
+        response = self.client.post('/students', json={
+            **student, "id": "ST-000101", "school_id": 999})
+        self.assertEqual(response.status_code, 404)
+        response = self.client.post('/students', json={
+            **student, "id": "ST-000101"})
+        self.assertEqual(response.status_code, 201)
+
+        for path, body in (
+                ('/students/ST-000101', None),
+                (f'/schools/{self.schools[0]}', None),
+                ('/students', {"ids": ["ST-000002"]})):
+            self.assertEqual(self.client.delete(path, json=body).status_code,
+                             200, path)
+        for path, body in (
+                ('/students', {**student, "id": "ST-000101"}),
+                ('/students', {**student, "id": "ST-000000"}),
+                ('/students', {**student, "id": "ST-000002"}),
+                ('/schools', {"name": "Escola 0", "capacity": 10})):
+            self.assertEqual(self.client.post(path, json=body).status_code,
+                             201, body)
+
+    def test_writes_stay_on_their_shard(self):
+        """Test deletions, occupancy and the per shard change cursor"""
+        start = self.client.get('/changes').get_json()["cursor"]
+        self.assertEqual(len(start.split(".")), SHARDS)
+
+        self.client.delete('/students/ST-000001')
+        self.client.delete('/students', json={"ids": ["ST-000002", "ST-X"]})
+        self.client.delete(f'/schools/{self.schools[3]}')
+
+        totals = self.client.get('/stats/occupancy').get_json()["totals"]
+        self.assertEqual(totals["schools"], 5)
+        self.assertEqual(totals["student_count"], 3)
+
+        data = self.client.get(f'/changes?since={start}').get_json()
+        self.assertEqual(len(data["changes"]), 4)
+        self.assertEqual(data["cursor"], data["changes"][-1]["cursor"])
+        data = self.client.get(f'/changes?since={data["cursor"]}').get_json()
+        self.assertEqual(data["changes"], [])
+        self.assertEqual(self.client.get('/changes?since=1.2').status_code,
+                         400)
+
+        response = self.client.get('/export/students?format=csv')
+        lines = response.get_data(as_text=True).splitlines()
+        self.assertEqual([line.split(",")[0] for line in lines[1:]],
+                         ["ST-000000", "ST-000004", "ST-000005"])
+
+    def test_async_mode_refuses_shards(self):
+        """Test that the ASGI app does not start on a sharded setup"""
+        with self.assertRaises(RuntimeError):
+            AsyncApp(self.app)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,4 +1,10 @@
-from .base import BaseTest, db, OFF_NUMBER, Student, School
+import csv
+import gzip
+import io
+import json
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import text
+from .base import BaseTest, db, OFF_NUMBER, Student, School, count_queries
 
 class TestStudentAPI(BaseTest):
 
@@ -68,6 +74,53 @@ class TestStudentAPI(BaseTest):
         self.assertEqual(response.status_code, 403)
         self.assertIn("error", response.get_data(as_text=True))
 
+    def test_create_student_updates_count(self):
+        """Test that creating and deleting students maintains the count"""
+        payload = {
+            "id": "ST-000003",
+            "first_name": "Maria",
+            "last_name": "Vila",
+            "school_id": 2
+        }
+        self.client.post('/students', json=payload)
+        self.assertEqual(self.client.get('/schools/2').get_json()
+                         ['student_count'], 1)
+
+        self.client.delete('/students/ST-000001')
+        payload["id"] = "ST-000004"
+        payload["school_id"] = 1
+        response = self.client.post('/students', json=payload)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.client.get('/schools/1').get_json()
+                         ['student_count'], 2)
+
+    def test_create_student_concurrent_capacity(self):
+        """Test that concurrent inserts cannot overfill a school"""
+        self.client.post('/schools', json={"name": "Petita", "capacity": 3})
+        with self.app.app_context():
+            school_id = db.session.execute(
+                    db.select(School.id).where(School.name == "Petita")
+                    ).scalar_one()
+
+        def enrol(i):
+            client = self.app.test_client()
+            return client.post('/students', json={
+                "id": f"ST-20000{i}",
+                "first_name": "Nom",
+                "last_name": "Cognom",
+                "school_id": school_id,
+            }).status_code
+
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            statuses = list(pool.map(enrol, range(8)))
+
+        self.assertEqual(statuses.count(201), 3)
+        self.assertEqual(statuses.count(403), 5)
+        with self.app.app_context():
+            school = db.session.get(School, school_id)
+            self.assertEqual(school.student_count, 3)
+            self.assertEqual(len(school.students), 3)
+
     def test_create_student_already_exist(self):
         """Test that adding a student fails if it already exist"""
         with self.app.app_context():
@@ -83,6 +136,104 @@ class TestStudentAPI(BaseTest):
         self.assertEqual(response.status_code, 409)
         self.assertIn("error", response.get_data(as_text=True))
 
+    def test_create_students_bulk(self):
+        """Test importing a JSON array reports a result for every row"""
+        payload = [
+            {"id": "ST-000010", "first_name": "Anna", "last_name": "Roca",
+             "school_id": 2},
+            {"id": "ST-000011", "first_name": "Pere", "last_name": "Roca",
+             "school_id": 1},
+            {"id": "ST-000001", "first_name": "Jordi", "last_name": "Pujol",
+             "school_id": 2},
+            {"id": "ST-000012", "first_name": "Joan", "last_name": "Mas",
+             "school_id": OFF_NUMBER},
+            {"id": "ST-000013", "first_name": "Laia"},
+            {"id": "ST-000010", "first_name": "Anna", "last_name": "Roca",
+             "school_id": 2},
+        ]
+        response = self.client.post('/students/bulk', json=payload)
+        data = response.get_json()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data['created'], 1)
+        self.assertEqual(data['failed'], 5)
+        self.assertEqual([r['status'] for r in data['results']],
+                         [201, 403, 409, 404, 400, 409])
+        self.assertEqual(self.client.get('/students/ST-000010').status_code,
+                         200)
+
+    def test_create_students_bulk_ndjson_chunks(self):
+        """Test importing NDJSON across several chunks respects capacity"""
+        self.app.config['BULK_CHUNK_SIZE'] = 2
+        self.client.post('/schools', json={"name": "Petita", "capacity": 3})
+        with self.app.app_context():
+            school_id = db.session.execute(
+                    db.select(School.id).where(School.name == "Petita")
+                    ).scalar_one()
+
+        lines = [
+            json.dumps({"id": f"ST-10000{i}", "first_name": "Nom",
+                        "last_name": "Cognom", "school_id": school_id})
+            for i in range(5)
+        ]
+        response = self.client.post('/students/bulk',
+                                    data="\n".join(lines) + "\nnot json\n",
+                                    content_type='application/x-ndjson')
+        data = response.get_json()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([r['status'] for r in data['results']],
+                         [201, 201, 201, 403, 403, 400])
+
+    def test_create_students_bulk_invalid_fields(self):
+        """Test that malformed ids, names and schools fail only their row"""
+        valid = {"first_name": "Anna", "last_name": "Roca", "school_id": 2}
+        payload = [
+            {**valid, "id": ["x"]},
+            {**valid, "id": "ST-000020", "first_name": None},
+            {**valid, "id": "ST-000021", "last_name": ""},
+            {**valid, "id": "ST-0000220"},
+            {**valid, "id": "ST-000023", "first_name": "A" * 51},
+            {**valid, "id": "ST-000025", "school_id": 2.7},
+            {**valid, "id": "ST-000026", "school_id": True},
+            {**valid, "id": "ST-000027", "school_id": "2"},
+            {**valid, "id": "ST-000024"},
+        ]
+        response = self.client.post('/students/bulk', json=payload)
+        data = response.get_json()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([r['status'] for r in data['results']],
+                         [400, 400, 400, 400, 400, 400, 400, 400, 201])
+        self.assertEqual(data['results'][1]['error'], "Invalid first_name")
+        self.assertEqual({r['error'] for r in data['results'][5:8]},
+                         {"Invalid school_id"})
+        self.assertEqual(self.client.get('/schools/2').get_json()
+                         ["student_count"], 1)
+
+    def test_create_students_bulk_retries_failed_ids(self):
+        """Test that an ID whose row failed can still be imported later"""
+        self.app.config['BULK_CHUNK_SIZE'] = 2
+        row = {"id": "ST-000030", "first_name": "Anna", "last_name": "Roca"}
+        payload = [
+            {**row, "school_id": OFF_NUMBER},
+            {**row, "school_id": 1},
+            {**row, "school_id": 2},
+            {**row, "school_id": 2},
+        ]
+        response = self.client.post('/students/bulk', json=payload)
+        data = response.get_json()
+
+        self.assertEqual([r['status'] for r in data['results']],
+                         [404, 403, 201, 409])
+        self.assertEqual(self.client.get('/students/ST-000030').get_json()
+                         ["school_id"], 2)
+
+    def test_create_students_bulk_requires_array(self):
+        """Test that a bulk import body must be a list"""
+        response = self.client.post('/students/bulk', json={"id": "x"})
+        self.assertEqual(response.status_code, 400)
+
     def test_delete_student_success(self):
         """Test deleting a student successfully"""
         response = self.client.delete('/students/ST-000001')
@@ -93,6 +244,158 @@ class TestStudentAPI(BaseTest):
         self.assertEqual(response.status_code, 404)
         self.assertIn("error", response.get_data(as_text=True))
 
+    def test_export_students_ndjson(self):
+        """Test streaming every student as NDJSON"""
+        response = self.client.get('/export/students')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        lines = response.get_data(as_text=True).splitlines()
+        self.assertEqual([json.loads(line) for line in lines], [
+            {"id": "ST-000001", "first_name": "Jordi",
+             "last_name": "Pujol", "school_id": 1},
+            {"id": "ST-000002", "first_name": "Maria",
+             "last_name": "Doblas", "school_id": 1},
+            ])
+
+    def test_export_students_csv_batches(self):
+        """Test that a CSV export spanning several fetch batches is whole"""
+        self.app.config["EXPORT_BATCH_SIZE"] = 2
+        for n in range(3, 8):
+            self.client.post('/students', json={
+                "id": f"ST-00000{n}", "first_name": "Pau",
+                "last_name": "Mas", "school_id": 2,
+                })
+
+        response = self.client.get('/export/students?format=csv')
+        self.assertEqual(response.mimetype, 'text/csv')
+        rows = list(csv.reader(io.StringIO(response.get_data(as_text=True))))
+        self.assertEqual(rows[0], ["id", "first_name", "last_name",
+                                   "school_id"])
+        self.assertEqual([row[0] for row in rows[1:]],
+                         [f"ST-00000{n}" for n in range(1, 8)])
+
+    def test_export_students_gzip(self):
+        """Test that the export is gzipped when the client accepts it"""
+        response = self.client.get('/export/students',
+                                   headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        lines = gzip.decompress(response.get_data()).splitlines()
+        self.assertEqual(len(lines), 2)
+
+        response = self.client.get('/export/students?format=xml')
+        self.assertEqual(response.status_code, 400)
+
+    def test_lookup_students(self):
+        """Test resolving many IDs at once, in request order"""
+        response = self.client.post('/students/lookup', json={
+            "ids": ["ST-000002", "ST-999999", "ST-000001", "ST-000002"],
+            })
+        self.assertEqual(response.status_code, 200)
+        data = response.get_json()
+        self.assertEqual([s['id'] for s in data['students']],
+                         ["ST-000002", "ST-000001"])
+        self.assertEqual(data['students'][1]['first_name'], "Jordi")
+        self.assertEqual(data['missing'], ["ST-999999"])
+
+    def test_lookup_students_limits(self):
+        """Test that lookups need a list of IDs no longer than the maximum"""
+        response = self.client.post('/students/lookup', json=["ST-000001"])
+        self.assertEqual(response.status_code, 400)
+
+        ids = [f"ST-{n:06}" for n in range(
+                self.app.config["LOOKUP_MAX_IDS"] + 1)]
+        response = self.client.post('/students/lookup', json={"ids": ids})
+        self.assertEqual(response.status_code, 400)
+
+    def test_delete_students_bulk(self):
+        """Test deleting a list of students, reporting the missing ones"""
+        response = self.client.delete('/students', json={
+            "ids": ["ST-000001", "ST-000002", "ST-000001", "ST-999999"],
+            })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json(),
+                         {"deleted": 2, "missing": ["ST-999999"]})
+        self.assertEqual(self.client.get('/students').get_json(), [])
+        self.assertEqual(self.client.get('/schools/1').get_json()
+                         ["student_count"], 0)
+
+    def test_delete_students_bulk_invalid(self):
+        """Test that the bulk delete requires a list of string IDs"""
+        for payload in ({"ids": "ST-000001"}, {"ids": [1]}, ["ST-000001"]):
+            response = self.client.delete('/students', json=payload)
+            self.assertEqual(response.status_code, 400)
+
+    def test_transfer_students(self):
+        """Test moving a list of students with a single UPDATE"""
+        with self.app.app_context():
+            with count_queries(self.app) as statements:
+                response = self.client.post('/students/transfer', json={
+                    "ids": ["ST-000001", "ST-000001"], "school_id": 2})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json(), {"moved": 1, "school_id": 2})
+        updates = [s for s in statements if s.startswith("UPDATE student")]
+        self.assertEqual(len(updates), 1)
+
+        self.assertEqual(self.client.get('/students/ST-000001').get_json()
+                         ["school_id"], 2)
+        self.assertEqual(self.client.get('/schools/1').get_json()
+                         ["student_count"], 1)
+        self.assertEqual(self.client.get('/schools/2').get_json()
+                         ["student_count"], 1)
+        changes = self.client.get('/changes').get_json()["changes"]
+        self.assertEqual([(c["action"], c["id"], c["school_id"])
+                          for c in changes],
+                         [("deleted", "ST-000001", 1),
+                          ("created", "ST-000001", 2)])
+
+    def test_transfer_whole_school(self):
+        """Test moving every student of a school"""
+        response = self.client.post('/students/transfer', json={
+            "from_school_id": 1, "school_id": 2})
+        self.assertEqual(response.get_json(), {"moved": 2, "school_id": 2})
+        data = self.client.get('/schools/2').get_json()
+        self.assertEqual(data["student_count"], 2)
+        self.assertEqual([s["id"] for s in data["students"]],
+                         ["ST-000001", "ST-000002"])
+        self.assertEqual(self.client.get('/schools/1').get_json()
+                         ["students"], [])
+
+    def test_transfer_students_is_atomic(self):
+        """Test that a refused transfer moves no student"""
+        full = self.client.post('/schools', json={
+            "name": "Escola Petita", "capacity": 1}).get_json()["id"]
+        cases = (
+            ({"ids": ["ST-000001", "ST-000002"], "school_id": full}, 403),
+            ({"from_school_id": 1, "school_id": full}, 403),
+            ({"ids": ["ST-000001", "ST-999999"], "school_id": 2}, 404),
+            ({"ids": ["ST-000001"], "school_id": OFF_NUMBER}, 404),
+            ({"from_school_id": OFF_NUMBER, "school_id": 2}, 404),
+        )
+        for payload, status in cases:
+            response = self.client.post('/students/transfer', json=payload)
+            self.assertEqual(response.status_code, status, payload)
+        self.assertEqual(response.get_json()["error"], "School not found")
+        response = self.client.post('/students/transfer', json=cases[2][0])
+        self.assertEqual(response.get_json()["missing"], ["ST-999999"])
+
+        self.assertEqual(self.client.get('/schools/1').get_json()
+                         ["student_count"], 2)
+        self.assertEqual(self.client.get(f'/schools/{full}').get_json()
+                         ["student_count"], 0)
+        self.assertEqual(self.client.get('/changes').get_json()["changes"][-1]
+                         ["resource"], "schools")
+
+    def test_transfer_students_invalid(self):
+        """Test that a transfer needs a school and ids or a source school"""
+        for payload in ({"school_id": 2},
+                        {"ids": ["ST-000001"], "from_school_id": 1,
+                         "school_id": 2},
+                        {"ids": ["ST-000001"], "school_id": "2"},
+                        {"ids": "ST-000001", "school_id": 2},
+                        ["ST-000001"]):
+            response = self.client.post('/students/transfer', json=payload)
+            self.assertEqual(response.status_code, 400, payload)
+
     def test_delete_student_by_nonexistent_id(self):
         """Test deleting a student fails when it is not found"""
         with self.app.app_context():
@@ -119,6 +422,29 @@ class TestStudentAPI(BaseTest):
         self.assertEqual(data[0]['first_name'], "Jordi")
         self.assertEqual(data[1]['first_name'], "Maria")
 
+    def test_get_students_paginated(self):
+        """Test walking the student list one page at a time"""
+        response = self.client.get('/students?limit=1')
+        data = response.get_json()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(data), 1)
+        self.assertEqual(data[0]['id'], "ST-000001")
+        cursor = response.headers['X-Next-Cursor']
+        self.assertEqual(cursor, "ST-000001")
+
+        response = self.client.get(f'/students?limit=1&after={cursor}')
+        data = response.get_json()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data[0]['id'], "ST-000002")
+        self.assertNotIn('X-Next-Cursor', response.headers)
+
+    def test_get_students_invalid_limit(self):
+        """Test that a malformed or out of range limit is rejected"""
+        for limit in ("abc", "0", "100000"):
+            response = self.client.get(f'/students?limit={limit}')
+            self.assertEqual(response.status_code, 400)
+            self.assertIn("error", response.get_data(as_text=True))
+
     def test_get_student_by_id_success(self):
         """Test retrieving a specific student by ID successfully"""
         response = self.client.get('/students/ST-000001')
@@ -126,6 +452,18 @@ class TestStudentAPI(BaseTest):
         self.assertEqual(response.status_code, 200)
         self.assertEqual(data['last_name'], "Pujol")
 
+    def test_get_student_by_id_not_modified(self):
+        """Test that a student is revalidated until students change"""
+        etag = self.client.get('/students/ST-000001').headers['ETag']
+        response = self.client.get('/students/ST-000001',
+                                   headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+
+        self.client.delete('/students/ST-000002')
+        response = self.client.get('/students/ST-000001',
+                                   headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+
     def test_get_student_by_id_nonexistent(self):
         """Test getting a student fails when it does not exist"""
         with self.app.app_context():
@@ -148,6 +486,42 @@ class TestStudentAPI(BaseTest):
         self.assertEqual(response.status_code, 200)
         self.assertEqual(len(response.get_json()), 1)
 
+    def test_search_student_index_follows_writes(self):
+        """Test that created and deleted students are reflected in search"""
+        self.client.post('/students', json={
+            "id": "ST-000003",
+            "first_name": "Pau",
+            "last_name": "Casals",
+            "school_id": 2,
+        })
+        response = self.client.get('/students/search?query=casal')
+        self.assertEqual([s['id'] for s in response.get_json()],
+                         ["ST-000003"])
+
+        self.client.delete('/students/ST-000001')
+        response = self.client.get('/students/search?query=pujol')
+        self.assertEqual(response.get_json(), [])
+
+    def test_rebuild_search_command(self):
+        """Test that flask rebuild-search restores a stale index"""
+        with self.app.app_context():
+            db.session.execute(text("INSERT INTO student_search"
+                                    "(student_search) VALUES ('delete-all')"))
+            db.session.commit()
+        response = self.client.get('/students/search?query=pujol')
+        self.assertEqual(response.get_json(), [])
+
+        result = self.app.test_cli_runner().invoke(args=["rebuild-search"])
+        self.assertIn("Rebuilt the search indexes", result.output)
+        response = self.client.get('/students/search?query=pujol')
+        self.assertEqual([s['id'] for s in response.get_json()],
+                         ["ST-000001"])
+
+    def test_search_student_invalid_limit(self):
+        """Test that a malformed search limit is rejected"""
+        response = self.client.get('/students/search?query=jordi&limit=x')
+        self.assertEqual(response.status_code, 400)
+
     def test_search_student(self):
         """
         Test searching student by string in first name or last name successfully